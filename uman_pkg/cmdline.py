@@ -12,6 +12,28 @@ import os
 import sys
 
 
+def positive(conv):
+    """Get an argparse type which only accepts values greater than zero
+
+    Args:
+        conv (type): Type to convert the value with, e.g. int or float
+
+    Returns:
+        function: Function which converts a string argument, raising
+            argparse.ArgumentTypeError if the value is not positive
+    """
+    def check(value):
+        try:
+            result = conv(value)
+        except ValueError:
+            result = None
+        if result is None or result <= 0:
+            raise argparse.ArgumentTypeError(
+                f"invalid positive {conv.__name__} value: '{value}'")
+        return result
+    return check
+
+
 def get_git_actions():
     """Get git actions from cmdgit module
 
@@ -177,6 +199,21 @@ def add_pytest_subparser(subparsers):
     pyt.add_argument(
         '--pollute', metavar='TEST',
         help='Find which test pollutes TEST (causes it to fail)')
+    pyt.add_argument(
+        '--pollute-jobs', type=positive(int), default=1, metavar='JOBS',
+        help='Number of --pollute runs to do in parallel (default: 1)')
+    pyt.add_argument(
+        '--pollute-timeout', type=positive(float), metavar='SECS',
+        help='Stop a --pollute run after SECS and count it as a failure')
+    pyt.add_argument(
+        '--no-cache', action='store_true',
+        help='Do not use cached --pollute results or board lists')
+    pyt.add_argument(
+        '--trust-target', action='store_true',
+        help='With --pollute, skip checking that TEST passes alone')
+    pyt.add_argument(
+        '--shard', metavar='I/N',
+        help='Run only shard I of N (0-based), split by test-ID hash')
     pyt.add_argument(
         '--build-dir', metavar='DIR',
         help='Override build directory (default: /tmp/b/BOARD)')
@@ -10,14 +10,15 @@ test framework.
 
 import ast
 import collections
-import glob
-import math
+import functools
 import os
 import re
+import shlex
 import socket
 import subprocess
 import sys
 import time
+import zlib
 
 # pylint: disable=import-error
 from u_boot_pylib import command
@@ -27,13 +28,63 @@ from u_boot_pylib import tout
 from uman_pkg import build as build_mod
 from uman_pkg import settings
 from uman_pkg.cmdtest import get_sandbox_path
-from uman_pkg.util import exec_cmd, get_uboot_dir, show_summary
+from uman_pkg.util import (exec_cmd, get_uboot_dir, git_output, read_cache,
+                           show_summary, write_cache)
 
 # Pattern to parse test spec: TestClass:method or TestClass.method or just name
 RE_TEST_SPEC = re.compile(r'(?:Test)?(\w+?)(?:[:.](\w+))?$', re.IGNORECASE)
 
-# Glob pattern to find test files (use with .format(name=...))
-GLOB_TEST = 'test/py/**/test_{name}.py'
+# Separator between class and method in a test spec: : or ::
+RE_SPEC_SEP = re.compile(r'::?')
+
+# Shell variable reference: ${name}
+RE_VAR_REF = re.compile(r'\$\{([^}]+)\}')
+
+# Position before each capital letter except the first, for snake_case
+RE_CAMEL = re.compile(r'(?<!^)(?=[A-Z])')
+
+# FsHelper() call in a fixture, giving the filesystem type and image prefix
+RE_FS_HELPER = re.compile(r"FsHelper\s*\([^,]+,\s*['\"](\w+)['\"].*?"
+                          r"prefix\s*=\s*['\"](\w+)['\"]",
+                          re.DOTALL | re.ASCII)
+
+# image_path assignment in a fixture, giving the image filename
+RE_IMG_PATH = re.compile(r"image_path\s*=.*?['\"](\w+\.img)['\"]",
+                         re.DOTALL | re.ASCII)
+
+# Result line from a sandbox unit test, matched against the raw output
+RE_RESULT = re.compile(rb'Result: (PASS|FAIL|SKIP):')
+
+# Parsed hook config files: path -> (mtime in ns, variables)
+HOOK_CONFIG = {}
+
+# Directory holding the Python tests, relative to the U-Boot tree
+TEST_PY_DIR = 'test/py'
+
+# Directories under TEST_PY_DIR which never hold test files
+SKIP_TEST_DIRS = {'__pycache__', '.pytest_cache', '.git'}
+
+# pytest plugins which uman does not use, each with the options that need it.
+# Disabling them saves work at every pytest start-up, e.g. cacheprovider
+# reading and writing .pytest_cache
+UNUSED_PLUGINS = {
+    'cacheprovider': ['--lf', '--last-failed', '--ff', '--failed-first',
+                      '--nf', '--new-first', '--sw', '--stepwise',
+                      '--sw-skip', '--stepwise-skip', '--cache-show',
+                      '--cache-clear'],
+    'stepwise': ['--sw', '--stepwise', '--sw-skip', '--stepwise-skip'],
+    'junitxml': ['--junitxml', '--junit-xml'],
+    'doctest': ['--doctest-modules', '--doctest-glob'],
+}
+
+# Simple on/off options: args attribute and the pytest flags to pass for it
+PYTEST_FLAGS = [
+    ('quiet', ['--no-header', '--quiet-hooks']),
+    ('show_output', ['-s']),
+    ('setup_only', ['--setup-only']),
+    ('persist', ['--persist']),
+    ('exitfirst', ['-x']),
+]
 
 # Named tuple for C test information extracted from Python test files
 #
@@ -50,6 +101,42 @@ GLOB_TEST = 'test/py/**/test_{name}.py'
 CTestInfo = collections.namedtuple('CTestInfo',
                                    ['suite', 'c_test', 'kwargs', 'fixtures'])
 
+# Result returned when no C test can be found
+NO_CTEST = CTestInfo(None, None, None, None)
+
+
+@functools.lru_cache(maxsize=None)
+def path_exists(path):
+    """Check whether a configured path exists, e.g. the test-hooks directory
+
+    This is cached since several functions check the same paths for one
+    command. The cache is cleared when each command starts and after
+    building, since a build may create paths, e.g. the build directory.
+
+    Args:
+        path (str): Path to check
+
+    Returns:
+        bool: True if the path exists
+    """
+    return os.path.exists(path)
+
+
+def build_board(board, args):
+    """Build a board and forget any paths checked before the build
+
+    Args:
+        board (str): Board to build
+        args (argparse.Namespace): Arguments from cmdline
+
+    Returns:
+        bool: True if the build succeeded
+    """
+    if not build_mod.build_board(board, args.dry_run, args.lto):
+        return False
+    path_exists.cache_clear()
+    return True
+
 
 def setup_riscv_env(board, env):
     """Set up OPENSBI environment for RISC-V boards
@@ -68,7 +155,7 @@ def setup_riscv_env(board, env):
                 opensbi = rv64_path.replace('.bin', '_rv32.bin')
     else:
         opensbi = settings.get('opensbi', fallback=None)
-    if opensbi and os.path.exists(opensbi):
+    if opensbi and path_exists(opensbi):
         env['OPENSBI'] = opensbi
     elif opensbi:
         tout.warning(f'OPENSBI firmware not found: {opensbi}')
@@ -89,7 +176,7 @@ def setup_sbsa_env(board, env):
         blobs_dir = settings.get('blobs_dir', fallback=None)
         if blobs_dir:
             tfa_dir = os.path.join(blobs_dir, 'tfa')
-    if tfa_dir and os.path.exists(tfa_dir):
+    if tfa_dir and path_exists(tfa_dir):
         # Add TF-A directory to binman search path
         current = os.environ.get('BINMAN_INDIRS', '')
         if current:
@@ -102,40 +189,52 @@ def setup_sbsa_env(board, env):
         tout.warning(f'No TF-A directory configured for {board}')
 
 
-def pytest_env(board):
+# Firmware set-up for board families: text in the board name and the
+# function which adds the environment variables needed
+ENV_SETUP = [
+    ('riscv', setup_riscv_env),
+    ('sbsa', setup_sbsa_env),
+]
+
+
+def pytest_env(board, uboot_dir=None):
     """Set up environment variables for pytest testing
 
     Args:
         board (str): Board name
+        uboot_dir (str): U-Boot source directory if the caller already has
+            it, else None to look it up
 
     Returns:
         dict: Environment variables that were set (not the full environment)
     """
     env = {}
 
-    if 'riscv' in board:
-        setup_riscv_env(board, env)
-
-    if 'sbsa' in board:
-        setup_sbsa_env(board, env)
+    for family, setup in ENV_SETUP:
+        if family in board:
+            setup(board, env)
 
     # Build PATH with hooks directories
     path_parts = []
 
     # Local hooks from U-Boot tree take precedence
-    uboot_dir = get_uboot_dir()
+    if not uboot_dir:
+        uboot_dir = get_uboot_dir()
     if uboot_dir:
         local_hooks = os.path.join(uboot_dir, 'test/hooks/bin')
-        if os.path.exists(local_hooks):
+        if path_exists(local_hooks):
             path_parts.append(local_hooks)
 
     # Then configured hooks from settings
     hooks = settings.get('test_hooks')
-    if hooks and os.path.exists(hooks):
+    if hooks:
+        # If bin/ exists then so does its parent, so check it first. This is
+        # also the path get_board_config() checks, so the result is shared
         hooks_bin = os.path.join(hooks, 'bin')
-        if os.path.exists(hooks_bin):
-            hooks = hooks_bin
-        path_parts.append(hooks)
+        if path_exists(hooks_bin):
+            path_parts.append(hooks_bin)
+        elif path_exists(hooks):
+            path_parts.append(hooks)
 
     if path_parts:
         current_path = os.environ.get('PATH', '')
@@ -144,16 +243,44 @@ def pytest_env(board):
     return env
 
 
-def list_boards_by_pattern(pattern):
+def get_boards_key(uboot_dir):
+    """Get a key identifying the set of boards in a U-Boot tree
+
+    Args:
+        uboot_dir (str): U-Boot source directory
+
+    Returns:
+        str: Key made from the tree, its commit and the configs/ directory,
+            which changes when a defconfig is added or removed, or None if
+            the commit cannot be determined
+    """
+    try:
+        sha = git_output('-C', uboot_dir, 'rev-parse', 'HEAD')
+        mtime = os.stat(os.path.join(uboot_dir, 'configs')).st_mtime_ns
+    except (command.CommandExc, OSError):
+        return None
+    return f'{uboot_dir}|{sha}|{mtime}'
+
+
+def list_boards_by_pattern(pattern, use_cache=False):
     """List available boards matching a pattern using buildman
 
     Args:
         pattern (str): Board pattern to match (e.g. 'qemu', 'sandbox')
+        use_cache (bool): True to reuse the list from an earlier run, if the
+            U-Boot tree has not changed since
 
     Returns:
         list: Sorted list of board names
     """
     uboot_dir = get_uboot_dir()
+    name = f'boards-{pattern}.json'
+    key = get_boards_key(uboot_dir) if use_cache and uboot_dir else None
+    if key:
+        boards = read_cache(name, key)
+        if isinstance(boards, list):
+            return boards
+
     orig_dir = os.getcwd()
     try:
         if uboot_dir:
@@ -166,74 +293,112 @@ def list_boards_by_pattern(pattern):
     if result.return_code != 0:
         return []
 
-    boards = []
-    for line in result.stdout.splitlines():
-        # Board names are on indented lines after "pattern : N boards"
-        if line.startswith('   '):
-            boards.extend(line.split())
-    return sorted(boards)
+    # Board names are on indented lines after "pattern : N boards"
+    boards = sorted(board for line in result.stdout.splitlines()
+                    if line.startswith('   ') for board in line.split())
+    if key and boards:
+        write_cache(name, key, boards)
+    return boards
 
 
-def list_qemu_boards():
+def list_qemu_boards(use_cache=False):
     """List available QEMU boards using buildman
 
+    Args:
+        use_cache (bool): True to reuse the list from an earlier run
+
     Returns:
         list: Sorted list of QEMU board names
     """
-    return list_boards_by_pattern('qemu')
+    return list_boards_by_pattern('qemu', use_cache)
 
 
-def build_pytest_cmd(args):
-    """Build the pytest command line
+def plugin_args(extra_args):
+    """Get pytest arguments to disable plugins which are not needed
 
     Args:
-        args (argparse.Namespace): Arguments from cmdline
+        extra_args (list): Extra pytest arguments from the user; any plugin
+            needed by one of these is left enabled
 
     Returns:
-        list: Command and arguments to run
+        list: pytest arguments, e.g. ['-p', 'no:doctest']
     """
-    cmd = ['./test/py/test.py']
-    cmd.extend(['-B', args.board])
+    args = []
+    for plugin, opts in UNUSED_PLUGINS.items():
+        if not any(arg.split('=', 1)[0] in opts for arg in extra_args):
+            args.extend(['-p', f'no:{plugin}'])
+    return args
+
+
+def get_build_dir(args, board=None, suffix=''):
+    """Get the build directory to use for a board
+
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
+        board (str): Board name, or None to use args.board
+        suffix (str): Suffix for the default directory, e.g. '-pollute'
 
+    Returns:
+        str: args.build_dir if given, else a directory for the board within
+            the configured build directory
+    """
     if args.build_dir:
-        build_dir = args.build_dir
-    else:
-        base_dir = settings.get('build_dir', '/tmp/b')
-        build_dir = f'{base_dir}/{args.board}'
-    cmd.extend(['--build-dir', build_dir])
+        return args.build_dir
+    base_dir = settings.get('build_dir', '/tmp/b')
+    return f'{base_dir}/{board or args.board}{suffix}'
 
-    if args.build:
-        cmd.append('--build')
 
-    cmd.append('--buildman')
+def get_test_spec(args):
+    """Get the -k expression for the test spec given by the user
 
-    cmd.extend(['--id', 'na'])
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
 
-    if args.test_spec:
-        # Convert Class:method or Class::method to "Class and method" for -k
-        spec = ' '.join(args.test_spec)
-        spec = spec.replace('::', ' and ').replace(':', ' and ')
-        cmd.extend(['-k', spec])
+    Returns:
+        str: Expression, with Class:method or Class::method converted to
+            "Class and method", or None if there is no test spec
+    """
+    if not args.test_spec:
+        return None
+    return RE_SPEC_SEP.sub(' and ', ' '.join(args.test_spec))
+
+
+def build_pytest_cmd(args, nodes=None):
+    """Build the pytest command line
+
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
+        nodes (list of str): Tests to run, as arguments from node_to_arg(),
+            or None to use args.test_spec
+
+    Returns:
+        list: Command and arguments to run
+    """
+    cmd = ['./test/py/test.py', '-B', args.board,
+           '--build-dir', get_build_dir(args)]
+    if args.build:
+        cmd.append('--build')
+    cmd += ['--buildman', '--id', 'na'] + plugin_args(args.extra_args)
+
+    # Name each test exactly, since -k also matches substrings, e.g.
+    # 'ut_dm_1' matches 'ut_dm_10'
+    if nodes:
+        cmd.extend(nodes)
+    elif args.test_spec:
+        cmd.extend(['-k', get_test_spec(args)])
 
     if args.no_timeout:
         cmd.append('--no-timeout')
 
     cmd.append('-q')
-    if args.quiet:
-        cmd.extend(['--no-header', '--quiet-hooks'])
-    if args.show_output:
-        cmd.append('-s')
+    for attr, flags in PYTEST_FLAGS:
+        if getattr(args, attr):
+            cmd.extend(flags)
     if args.timing is not None:
         cmd.extend(['--timing', '--durations=0',
                     f'--durations-min={args.timing}'])
-    if args.setup_only:
-        cmd.append('--setup-only')
-    if args.persist:
-        cmd.append('--persist')
     if args.gdbserver:
         cmd.extend(['--gdbserver', args.gdbserver])
-    if args.exitfirst:
-        cmd.append('-x')
     if not args.full:
         cmd.append('--no-full')
 
@@ -247,6 +412,9 @@ def build_pytest_cmd(args):
 def parse_hook_config(config_path):
     """Parse shell variable assignments from a hook config file
 
+    Each file is only parsed once while it is unchanged, since the same
+    config is needed several times for one command
+
     Args:
         config_path (str): Path to the config file
 
@@ -254,26 +422,35 @@ def parse_hook_config(config_path):
         dict: Dictionary of variable names to values
     """
     variables = {}
-    if not os.path.exists(config_path):
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except OSError:
         return variables
+    cached = HOOK_CONFIG.get(config_path)
+    if cached and cached[0] == mtime:
+        return dict(cached[1])
 
+    # These files are small, so read them in one go
     with open(config_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            # Skip comments and empty lines
-            if not line or line.startswith('#'):
-                continue
-            # Match variable assignments: name=value or name="value"
-            match = re.match(r'^([a-zA-Z_][a-zA-Z0-9_]*)=(.*)$', line)
-            if match:
-                name, value = match.groups()
-                # Remove surrounding quotes if present
-                if value.startswith('"') and value.endswith('"'):
-                    value = value[1:-1]
-                elif value.startswith("'") and value.endswith("'"):
-                    value = value[1:-1]
-                variables[name] = value
-    return variables
+        data = f.read()
+
+    for line in data.splitlines():
+        line = line.strip()
+        # Skip comments and empty lines
+        if not line or line.startswith('#'):
+            continue
+        # Variable assignments: name=value or name="value"
+        name, sep, value = line.partition('=')
+        if not sep or not name.isidentifier() or not name.isascii():
+            continue
+        # Remove surrounding quotes if present
+        if value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        elif value.startswith("'") and value.endswith("'"):
+            value = value[1:-1]
+        variables[name] = value
+    HOOK_CONFIG[config_path] = (mtime, variables)
+    return dict(variables)
 
 
 def expand_vars(value, env):
@@ -286,11 +463,25 @@ def expand_vars(value, env):
     Returns:
         str: String with variables expanded
     """
+    # Most values have no references, so skip the regex for those
+    if '${' not in value:
+        return value
+
     def replace_var(match):
         var_name = match.group(1)
         return env.get(var_name, f'${{{var_name}}}')
 
-    return re.sub(r'\$\{([^}]+)\}', replace_var, value)
+    return RE_VAR_REF.sub(replace_var, value)
+
+
+@functools.lru_cache(maxsize=None)
+def get_hostname():
+    """Get the name of this machine, which selects the hook config to use
+
+    Returns:
+        str: Hostname
+    """
+    return socket.gethostname()
 
 
 def get_board_config(board):
@@ -310,11 +501,11 @@ def get_board_config(board):
         return None
 
     hooks_bin = os.path.join(hooks, 'bin')
-    if not os.path.exists(hooks_bin):
+    if not path_exists(hooks_bin):
         tout.error(f'Hooks bin directory not found: {hooks_bin}')
         return None
 
-    hostname = socket.gethostname()
+    hostname = get_hostname()
     board_id = 'na'  # Default board identifier
 
     # Build config file path
@@ -352,19 +543,15 @@ def get_qemu_command(board, args):
         return None
 
     # Build environment for variable expansion
-    if args.build_dir:
-        build_dir = args.build_dir
-    else:
-        base_dir = settings.get('build_dir', '/tmp/b')
-        build_dir = f'{base_dir}/{board}'
+    build_dir = get_build_dir(args, board)
 
-    env = os.environ.copy()
-    env['U_BOOT_BUILD_DIR'] = build_dir
-    env['UBOOT_TRAVIS_BUILD_DIR'] = build_dir
-
-    # Add OPENSBI if configured
+    # Add OPENSBI if configured. The environment is only read here, so
+    # layer the new variables over it rather than copying it
     pytest_vars = pytest_env(board)
-    env.update(pytest_vars)
+    env = collections.ChainMap(pytest_vars, {
+        'U_BOOT_BUILD_DIR': build_dir,
+        'UBOOT_TRAVIS_BUILD_DIR': build_dir,
+    }, os.environ)
 
     # Extract QEMU command components
     qemu_binary = config.get('qemu_binary', 'qemu-system-unknown')
@@ -396,7 +583,32 @@ def camel_to_snake(name):
     Returns:
         str: snake_case string (e.g., 'pxe_parser')
     """
-    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+    return RE_CAMEL.sub('_', name).lower()
+
+
+@functools.lru_cache(maxsize=None)
+def get_test_files(uboot_dir):
+    """Get an index of the Python test files in a U-Boot tree
+
+    The tree is only scanned once, since a lookup is needed for each test
+
+    Args:
+        uboot_dir (str): U-Boot source directory
+
+    Returns:
+        dict: Maps the name of each test file, without the 'test_' prefix
+            and '.py' suffix, to its full path. Where several files have the
+            same name, the first in sorted order is used
+    """
+    files = {}
+    for dirpath, dirnames, fnames in os.walk(os.path.join(uboot_dir,
+                                                          TEST_PY_DIR)):
+        dirnames[:] = sorted(name for name in dirnames
+                             if name not in SKIP_TEST_DIRS)
+        for fname in sorted(fnames):
+            if fname.startswith('test_') and fname.endswith('.py'):
+                files.setdefault(fname[5:-3], os.path.join(dirpath, fname))
+    return files
 
 
 def find_test(uboot_dir, test_spec):
@@ -419,11 +631,13 @@ def find_test(uboot_dir, test_spec):
     # Convert CamelCase to snake_case for file lookup
     snake_name = camel_to_snake(base_name)
 
-    # Search for test file
-    pattern = os.path.join(uboot_dir, GLOB_TEST.format(name=snake_name))
-    matches = glob.glob(pattern, recursive=True)
-    if matches:
-        test_file = matches[0]
+    # Most tests are directly in test/py/tests, so try there before scanning
+    # the whole tree
+    test_file = os.path.join(uboot_dir, TEST_PY_DIR, 'tests',
+                             f'test_{snake_name}.py')
+    if not os.path.isfile(test_file):
+        test_file = get_test_files(uboot_dir).get(snake_name)
+    if test_file:
         # Build class name from original base_name
         class_name = f'Test{base_name[0].upper()}{base_name[1:]}'
         return test_file, class_name, method
@@ -462,12 +676,13 @@ def parse_c_test_call(source, class_name, method_name):
 
     Returns:
         CTestInfo: Named tuple with suite, c_test, kwargs, fixtures fields,
-            or CTestInfo(None, None, None, None) on failure
+            or NO_CTEST on failure
     """
     tree = ast.parse(source)
 
-    # Find the class and method
-    for node in ast.walk(tree):
+    # Find the class and method. Test classes are always at the top level,
+    # so there is no need to walk the whole tree
+    for node in tree.body:
         if not isinstance(node, ast.ClassDef) or node.name != class_name:
             continue
         for item in node.body:
@@ -482,8 +697,9 @@ def parse_c_test_call(source, class_name, method_name):
                             if arg.arg not in ('self', 'ubman')]
                 info = extract_run_ut_args(call)
                 return CTestInfo(info.suite, info.c_test, info.kwargs, fixtures)
+        break
 
-    return CTestInfo(None, None, None, None)
+    return NO_CTEST
 
 
 def extract_run_ut_args(call_node):
@@ -496,25 +712,25 @@ def extract_run_ut_args(call_node):
 
     Returns:
         CTestInfo: Named tuple with suite, c_test, kwargs fields
-            (fixtures=None), or CTestInfo(None, None, None, None) on failure
+            (fixtures=None), or NO_CTEST on failure
     """
     # Need at least 2 positional args: suite and test name
     if len(call_node.args) < 2:
-        return CTestInfo(None, None, None, None)
+        return NO_CTEST
 
     # Extract suite (first arg)
     if not isinstance(call_node.args[0], ast.Constant):
-        return CTestInfo(None, None, None, None)
+        return NO_CTEST
     suite = call_node.args[0].value
 
     # Extract test name (second arg) - add _norun suffix
     if not isinstance(call_node.args[1], ast.Constant):
-        return CTestInfo(None, None, None, None)
+        return NO_CTEST
     c_test = call_node.args[1].value + '_norun'
 
     # Extract all keyword arguments (e.g., fs_image=ext4_image, cfg_path=cfg)
     if not call_node.keywords:
-        return CTestInfo(None, None, None, None)
+        return NO_CTEST
 
     kwargs = []
     for kw in call_node.keywords:
@@ -522,24 +738,26 @@ def extract_run_ut_args(call_node):
             kwargs.append((kw.arg, kw.value.id))
 
     if not kwargs:
-        return CTestInfo(None, None, None, None)
+        return NO_CTEST
 
     return CTestInfo(suite, c_test, kwargs, None)
 
 
-def get_fixture_paths(test_file, kwargs, fixtures):
+def get_fixture_paths(test_file, kwargs, fixtures, source=None):
     """Get fixture paths for all kwargs in a run_ut() call
 
     Args:
         test_file (str): Path to Python test file
         kwargs (list): List of (arg_key, fixture_name) tuples from run_ut()
         fixtures (list): List of fixture names from method signature
+        source (str): Contents of test_file if already read, else None
 
     Returns:
         tuple: (paths_dict, reason) where paths_dict maps arg_key to path,
             or (None, reason) on failure
     """
-    source = tools.read_file(test_file, binary=False)
+    if source is None:
+        source = tools.read_file(test_file, binary=False)
     build_dir = settings.get('build_dir', '/tmp/b')
     persistent_dir = os.path.join(build_dir, 'sandbox', 'persistent-data')
 
@@ -557,10 +775,8 @@ def get_fixture_paths(test_file, kwargs, fixtures):
         if arg_key in ('fs_image', 'image'):
             # Search in fixture definitions for FsHelper pattern
             for fixture_src in fixture_defs.values():
-                match = re.search(
-                    r"FsHelper\s*\([^,]+,\s*['\"](\w+)['\"].*?"
-                    r"prefix\s*=\s*['\"](\w+)['\"]",
-                    fixture_src, re.DOTALL)
+                match = ('FsHelper' in fixture_src and
+                         RE_FS_HELPER.search(fixture_src))
                 if match:
                     fs_type = match.group(1)
                     prefix = match.group(2)
@@ -572,8 +788,8 @@ def get_fixture_paths(test_file, kwargs, fixtures):
 
             # Look for image_path pattern in fixture definitions
             for fixture_src in fixture_defs.values():
-                match = re.search(r"image_path\s*=.*?['\"](\w+\.img)['\"]",
-                                  fixture_src, re.DOTALL)
+                match = ('image_path' in fixture_src and
+                         RE_IMG_PATH.search(fixture_src))
                 if match:
                     img_name = match.group(1)
                     paths[arg_key] = os.path.join(persistent_dir, img_name)
@@ -616,7 +832,7 @@ def run_c_test(args):
 
     # Build if requested
     if args.build:
-        if not build_mod.build_board('sandbox', args.dry_run, args.lto):
+        if not build_board('sandbox', args):
             return 1
 
     sandbox = get_sandbox_path()
@@ -641,7 +857,8 @@ def run_c_test(args):
         return 1
 
     # Get fixture paths for all kwargs
-    paths, reason = get_fixture_paths(test_file, info.kwargs, info.fixtures)
+    paths, reason = get_fixture_paths(test_file, info.kwargs, info.fixtures,
+                                      source)
     if not paths:
         tout.error(f'Test {reason} - not suitable for -C')
         tout.notice(f'Run the full test instead: um py {test_name}')
@@ -653,8 +870,9 @@ def run_c_test(args):
             tout.error(f'Setup not done, run: um py -SP {test_name}')
             return 1
 
-    # Build ut command with all kwargs
-    ut_args = ' '.join(f'{k}={v}' for k, v in paths.items())
+    # Build ut command with all kwargs, quoting values since sandbox splits
+    # the -c string itself
+    ut_args = ' '.join(f'{k}={shlex.quote(v)}' for k, v in paths.items())
     ut_cmd = f'ut -Em {info.suite} {info.c_test} {ut_args}'
     cmd = [sandbox, '-T', '-F', '-c', ut_cmd]
     if args.show_output:
@@ -662,7 +880,7 @@ def run_c_test(args):
 
     start = time.time()
     result = exec_cmd(cmd, dry_run=args.dry_run,
-                      capture=not args.show_output)
+                      capture=not args.show_output, binary=True)
     elapsed = time.time() - start
 
     if not result:
@@ -671,19 +889,19 @@ def run_c_test(args):
     # Parse result and count passed/failed/skipped
     passed = failed = skipped = 0
     if not args.show_output:
-        match = re.search(r'Result: (PASS|FAIL|SKIP):', result.stdout)
+        match = RE_RESULT.search(result.stdout)
         if match:
             status = match.group(1)
-            if status == 'PASS':
+            if status == b'PASS':
                 passed = 1
-            elif status == 'FAIL':
+            elif status == b'FAIL':
                 failed = 1
-            elif status == 'SKIP':
+            elif status == b'SKIP':
                 skipped = 1
 
         # Show output only on failure
         if failed and result.stdout:
-            print(result.stdout, end='')
+            print(result.stdout.decode('utf-8', errors='replace'), end='')
 
     show_summary(passed, failed, skipped, elapsed)
 
@@ -700,11 +918,7 @@ def run_with_gdb(args):
         int: Exit code
     """
     # Get the U-Boot executable path
-    if args.build_dir:
-        build_dir = args.build_dir
-    else:
-        base_dir = settings.get('build_dir', '/tmp/b')
-        build_dir = f'{base_dir}/{args.board}'
+    build_dir = get_build_dir(args)
     uboot_exe = os.path.join(build_dir, 'u-boot')
 
     if not os.path.exists(uboot_exe):
@@ -731,15 +945,20 @@ def run_with_gdb(args):
     else:
         host, port = 'localhost', int(channel)
 
+    # Resolve the address once, rather than on every check
+    try:
+        addr = socket.getaddrinfo(host, port, socket.AF_INET,
+                                  socket.SOCK_STREAM)[0][4]
+    except OSError:
+        addr = (host, port)
+
     def port_alive():
         """Check if gdbserver port is accepting connections"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(0.5)
-            sock.connect((host, port))
-            sock.close()
-            return True
-        except (ConnectionRefusedError, socket.timeout, OSError):
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.settimeout(0.1)
+                return sock.connect_ex(addr) == 0
+        except OSError:
             return False
 
     # Run gdb in a loop, reconnecting when server restarts
@@ -784,23 +1003,23 @@ def run_with_gdb(args):
     return 0
 
 
-def collect_tests(args):
+def collect_tests(args, build_dir=None):
     """Collect all tests using pytest --collect-only
 
     Args:
         args (argparse.Namespace): Arguments from cmdline
+        build_dir (str): Build directory, or None to use args.build_dir or
+            the pollute build directory
 
     Returns:
         list: Ordered list of test node IDs, or None on error
     """
-    if args.build_dir:
-        build_dir = args.build_dir
-    else:
-        base_dir = settings.get('build_dir', '/tmp/b')
-        build_dir = f'{base_dir}/{args.board}-pollute'
+    if not build_dir:
+        build_dir = get_build_dir(args, suffix='-pollute')
 
     cmd = ['./test/py/test.py', '-B', args.board, '--build-dir', build_dir,
            '--buildman', '--id', 'na', '--collect-only', '-q']
+    cmd.extend(plugin_args([]))
 
     if args.build:
         cmd.append('--build')
@@ -808,8 +1027,7 @@ def collect_tests(args):
         cmd.append('--no-full')
 
     if args.test_spec:
-        spec = ' '.join(args.test_spec)
-        cmd.extend(['-k', spec])
+        cmd.extend(['-k', get_test_spec(args)])
 
     result = command.run_pipe([cmd], capture=True, capture_stderr=True,
                               raise_on_error=False)
@@ -823,13 +1041,9 @@ def collect_tests(args):
                 print(result.stderr)
         return None
 
-    tests = []
-    for line in result.stdout.splitlines():
-        line = line.strip()
-        # Test lines contain :: (e.g., test_ut.py::TestUt::test_dm)
-        if '::' in line and not line.startswith('<'):
-            tests.append(line)
-    return tests
+    # Test lines contain :: (e.g., test_ut.py::TestUt::test_dm)
+    return [line for line in map(str.strip, result.stdout.splitlines())
+            if '::' in line and not line.startswith('<')]
 
 
 def find_tests(args):
@@ -885,180 +1099,150 @@ def node_to_name(node_id):
     return node_id
 
 
-def pollute_run(tests, target, args, env):
-    """Run a subset of tests followed by the target test
+def node_to_arg(node_id):
+    """Convert a pytest node ID to an argument which selects just that test
+
+    Node IDs are relative to the pytest rootdir, which may be TEST_PY_DIR
+    rather than the U-Boot tree, where pytest is run
 
     Args:
-        tests (list): Tests to run before target (full node IDs)
-        target (str): Target test that may fail (full node ID)
-        args (argparse.Namespace): Arguments from cmdline
-        env (dict): Environment variables
+        node_id (str): Full node ID like 'tests/test_ut.py::test_ut[ut_dm_foo]'
 
     Returns:
-        bool: True if target test failed, False if it passed
+        str: Node ID with a path which is valid from the U-Boot tree
     """
-    if args.build_dir:
-        build_dir = args.build_dir
-    else:
-        base_dir = settings.get('build_dir', '/tmp/b')
-        build_dir = f'{base_dir}/{args.board}-pollute'
+    path, sep, rest = node_id.partition('::')
+    test_path = os.path.join(TEST_PY_DIR, path)
+    if not path_exists(path) and path_exists(test_path):
+        return test_path + sep + rest
+    return node_id
 
-    # Convert node IDs to test names and join with "or" for -k
-    all_tests = tests + [target]
-    names = [node_to_name(t) for t in all_tests]
-    spec = ' or '.join(names)
 
-    cmd = ['./test/py/test.py', '-B', args.board, '--build-dir', build_dir,
-           '--buildman', '--id', 'na', '-q', '-k', spec]
-    if args.lto:
-        cmd.append('--lto')
-    if not args.full:
-        cmd.append('--no-full')
+def parse_shard(spec):
+    """Parse a shard specification
 
-    total = len(all_tests)
-    done = 0
-    # pytest result chars: . pass, F fail, s skip, E error, x xfail, X xpass
-    result_chars = '.FsExX'
+    Args:
+        spec (str): Shard in the form 'I/N', e.g. '0/4'
+
+    Returns:
+        tuple: (index, total), or None if the spec is invalid
+    """
+    index, sep, total = spec.partition('/')
+    if not sep or not index.isdigit() or not total.isdigit():
+        return None
+    index, total = int(index), int(total)
+    if index >= total:
+        return None
+    return index, total
 
-    # Run with Popen to show progress as tests complete
-    # pylint: disable=consider-using-with
-    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    while True:
-        char = proc.stdout.read(1)
-        if not char:
-            break
-        if char.decode('utf-8', errors='replace') in result_chars:
-            done += 1
-            tout.progress(f'    {done}/{total}', trailer='')
-    tout.clear_progress()
-    proc.wait()
-    return proc.returncode != 0
 
+def shard_tests(tests, index, total):
+    """Select the tests which belong to a shard
 
-def do_pollute(args):
-    """Find which test pollutes the target test
+    Tests are assigned by a CRC32 of their node ID, so the split is the same
+    on every run and every machine, unlike hash() which depends on
+    PYTHONHASHSEED
 
     Args:
-        args (argparse.Namespace): Arguments from cmdline
+        tests (list): Test node IDs
+        index (int): Shard to select (0 to total - 1)
+        total (int): Number of shards
 
     Returns:
-        int: Exit code
+        list: Node IDs in the shard, in their original order
     """
-    target = args.pollute
+    return [t for t in tests if zlib.crc32(t.encode()) % total == index]
 
-    # Find U-Boot source directory
-    uboot_dir = get_uboot_dir()
-    if not uboot_dir:
-        tout.error('Not in a U-Boot tree and $USRC not set')
-        return 1
 
-    # Change to U-Boot directory if needed
-    if uboot_dir != os.getcwd():
-        os.chdir(uboot_dir)
+def select_shard(args):
+    """Select the tests in the requested shard
 
-    # Build to the pollute directory if requested
-    if args.build:
-        base_dir = settings.get('build_dir', '/tmp/b')
-        build_dir = f'{base_dir}/{args.board}-pollute'
-        tout.notice(f'Building to {build_dir}...')
-        cmd = ['buildman', '-I', '-w', '--boards', args.board, '-o', build_dir]
-        if not args.lto:
-            cmd.insert(1, '-L')
-        result = exec_cmd(cmd, args.dry_run, capture=False)
-        if result and result.return_code != 0:
-            tout.error('Build failed')
-            return 1
+    Collects the tests matching args.test_spec and picks those in the shard
+    selected by args.shard. They are passed to pytest by node ID rather than
+    with -k, so that no test runs in more than one shard
 
-    tout.notice('Collecting tests...')
-    tests = collect_tests(args)
-    if tests is None:
-        return 1
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
 
-    # Find target in test list
-    target_idx = None
-    for i, test in enumerate(tests):
-        if target in test:
-            target_idx = i
-            target = test  # Use full test name
-            break
+    Returns:
+        list of str: Arguments from node_to_arg() for the tests in the shard,
+            which may be empty, or None on error
+    """
+    shard = parse_shard(args.shard)
+    if not shard:
+        tout.error(f"Invalid shard '{args.shard}': use I/N with I < N")
+        return None
 
-    if target_idx is None:
-        tout.error(f"Target test '{args.pollute}' not found in collection")
-        tout.info('Available tests containing that string:')
-        for test in tests:
-            if args.pollute.lower() in test.lower():
-                print(f'  {test}')
-        return 1
+    build_dir = get_build_dir(args)
+    tests = collect_tests(args, build_dir)
+    if tests is None:
+        return None
 
-    tout.notice(f"Found {len(tests)} tests, target '{target}' at position "
-                f'{target_idx + 1}')
+    tests = shard_tests(tests, *shard)
+    if not tests:
+        tout.warning(f'No tests in shard {args.shard}')
+    else:
+        tout.notice(f'Shard {args.shard}: {len(tests)} test(s)')
+    return [node_to_arg(t) for t in tests]
 
-    if target_idx == 0:
-        tout.error('Target is the first test - nothing can pollute it')
-        return 1
 
-    candidates = tests[:target_idx]
-    pytest_vars = pytest_env(args.board)
-    env = os.environ.copy()
-    env.update(pytest_vars)
+def setup_board(args):
+    """Set up the board to use, taking it from $b if not given
 
-    # Verify target passes alone
-    tout.notice('Verifying target passes alone...')
-    if pollute_run([], target, args, env):
-        tout.error('Target test fails when run alone - not a pollution issue')
-        return 1
-    tout.notice('  OK')
+    Args:
+        args (argparse.Namespace): Arguments from cmdline; args.board is
+            updated
 
-    # Verify target fails with all candidates
-    tout.notice('Verifying target fails with all prior tests...')
-    if not pollute_run(candidates, target, args, env):
-        tout.error('Target test passes with all prior tests - cannot reproduce')
-        return 1
-    tout.notice('  FAIL (confirmed)')
-
-    # Binary search
-    steps = math.ceil(math.log2(len(candidates))) if candidates else 0
-    step = 0
-
-    tout.notice(f'Searching for polluter in {len(candidates)} candidates...')
-    while len(candidates) > 1:
-        step += 1
-        mid = len(candidates) // 2
-        first_half = candidates[:mid]
-
-        print(f'  Step {step}/{steps}: {len(first_half)} tests...')
-        if pollute_run(first_half, target, args, env):
-            tout.notice('  -> FAIL (polluter in first half)')
-            candidates = first_half
-        else:
-            tout.notice('  -> PASS (polluter in second half)')
-            candidates = candidates[mid:]
+    Returns:
+        bool: True if there is a board, False if not
+    """
+    args.board = args.board or os.environ.get('b')
+    if not args.board:
+        tout.error('Board is required: use -B BOARD or set $b (use -l to list)')
+        return False
+    return True
 
-    if not candidates:
-        tout.error('No polluter found - may need multiple tests to trigger')
-        return 1
 
-    polluter = candidates[0]
+def list_boards(args):
+    """Show the QEMU and sandbox boards which can be used with pytest
 
-    # Final verification
-    print(f'  Verifying {node_to_name(polluter)}...')
-    if pollute_run([polluter], target, args, env):
-        tout.notice('  -> FAIL (confirmed)')
-    else:
-        tout.notice('  -> PASS (inconclusive - may need multiple tests)')
-        return 1
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
 
-    polluter_name = node_to_name(polluter)
-    target_name = node_to_name(target)
-    red = '\033[31m'
-    reset = '\033[0m'
-    tout.notice(
-        f'\nFound: {target_name} polluted by {red}{polluter_name}{reset}')
-    tout.notice(f'  Run: uman py -B {args.board} "{polluter} or {target}"')
+    Returns:
+        int: Exit code (always 0)
+    """
+    qemu_boards = list_qemu_boards(not args.no_cache)
+    sandbox_boards = list_boards_by_pattern('sandbox', not args.no_cache)
+    if qemu_boards:
+        tout.notice('Available QEMU boards:')
+        for board in qemu_boards:
+            print(f'  {board}')
+    if sandbox_boards:
+        tout.notice('Available sandbox boards:')
+        for board in sandbox_boards:
+            print(f'  {board}')
+    if not qemu_boards and not sandbox_boards:
+        tout.warning('No boards found (is buildman configured?)')
     return 0
 
 
+def show_cmd(args):
+    """Show the QEMU command line for the selected board
+
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
+
+    Returns:
+        int: Exit code
+    """
+    qemu_cmd = get_qemu_command(args.board, args)
+    if qemu_cmd:
+        print(qemu_cmd)
+        return 0
+    return 1
+
+
 def do_pytest(args):  # pylint: disable=too-many-return-statements,too-many-branches
     """Handle pytest command - run pytest tests for U-Boot
 
@@ -1068,34 +1252,16 @@ def do_pytest(args):  # pylint: disable=too-many-return-statements,too-many-bran
     Returns:
         int: Exit code
     """
+    path_exists.cache_clear()
     if args.list_boards:
-        qemu_boards = list_qemu_boards()
-        sandbox_boards = list_boards_by_pattern('sandbox')
-        if qemu_boards:
-            tout.notice('Available QEMU boards:')
-            for board in qemu_boards:
-                print(f'  {board}')
-        if sandbox_boards:
-            tout.notice('Available sandbox boards:')
-            for board in sandbox_boards:
-                print(f'  {board}')
-        if not qemu_boards and not sandbox_boards:
-            tout.warning('No boards found (is buildman configured?)')
-        return 0
+        return list_boards(args)
 
     # Handle -C option: run just the C test part
     if args.c_test:
         return run_c_test(args)
 
-    board = args.board or os.environ.get('b')
-    if not board:
-        tout.error('Board is required: use -B BOARD or set $b (use -l to list)')
+    if not setup_board(args):
         return 1
-    args.board = board
-
-    # Handle --pollute option
-    if args.pollute:
-        return do_pollute(args)
 
     # Handle --find option
     if args.find:
@@ -1103,11 +1269,7 @@ def do_pytest(args):  # pylint: disable=too-many-return-statements,too-many-bran
 
     # Handle --show-cmd option
     if args.show_cmd:
-        qemu_cmd = get_qemu_command(board, args)
-        if qemu_cmd:
-            print(qemu_cmd)
-            return 0
-        return 1
+        return show_cmd(args)
 
     # Find U-Boot source directory
     uboot_dir = get_uboot_dir()
@@ -1128,29 +1290,51 @@ def do_pytest(args):  # pylint: disable=too-many-return-statements,too-many-bran
 
     # Build with um if requested, rather than letting pytest do it
     if args.build:
-        if not build_mod.build_board(args.board, args.dry_run, args.lto):
+        if not build_board(args.board, args):
             return 1
         args.build = False  # Don't build again in pytest
 
+    # Handle --shard: run just this shard's tests
+    nodes = None
+    if args.shard:
+        nodes = select_shard(args)
+        if nodes is None:
+            return 1
+        if not nodes:
+            return 0
+
     # Show -G command hint when using -g (not in dry-run mode)
     if args.gdbserver and not args.gdb and not args.dry_run:
         tout.notice(f'In another terminal: um py -G -B {args.board}')
 
-    pytest_vars = pytest_env(args.board)
-    cmd = build_pytest_cmd(args)
-
-    env = os.environ.copy()
-    env.update(pytest_vars)
-
     # Handle -G: just launch gdb to connect to existing gdbserver
     if args.gdb:
         return run_with_gdb(args)
 
-    result = exec_cmd(cmd, args.dry_run, env=env, capture=False)
+    pytest_vars = pytest_env(args.board, uboot_dir)
+    cmd = build_pytest_cmd(args, nodes)
 
-    if result is None:  # dry-run
+    # A dry run only shows the variables which differ from the current
+    # environment, so there is no need for a full copy
+    if args.dry_run:
+        exec_cmd(cmd, dry_run=True, env=pytest_vars)
         return 0
 
+    env = os.environ.copy()
+    env.update(pytest_vars)
+
+    # With -q and -f there is nothing left to report once pytest finishes,
+    # so hand the process over to it rather than waiting around. Flush
+    # first, since anything still buffered is lost on exec, e.g. when
+    # stdout is a pipe
+    if args.quiet and args.full and os.name != 'nt':
+        tout.info(f'Running: {shlex.join(cmd)}')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execvpe(cmd[0], cmd, env)
+
+    result = exec_cmd(cmd, env=env, capture=False)
+
     if result.return_code != 0:
         if 'unrecognized arguments: --no-full' in result.stderr:
             tout.error(
@@ -8,41 +8,106 @@ This module handles the 'test' subcommand which runs U-Boot's unit tests
 in sandbox.
 """
 
-from collections import namedtuple
+import bisect
+from collections import Counter, defaultdict, namedtuple
+import functools
+import mmap
 import os
 import re
 import struct
 import time
 
+try:
+    from elftools.elf.elffile import ELFFile
+    ELFTOOLS_AVAILABLE = True
+except ImportError:
+    ELFTOOLS_AVAILABLE = False
+
 # pylint: disable=import-error
 from u_boot_pylib import command
 from u_boot_pylib import terminal
 from u_boot_pylib import tout
 
 from uman_pkg import build, settings
-from uman_pkg.util import run_pytest, show_summary
+from uman_pkg.util import read_cache, run_pytest, show_summary, write_cache
 
 # Named tuple for test result counts
 TestCounts = namedtuple('TestCounts', ['passed', 'failed', 'skipped'])
 
-# Patterns for parsing linker-list symbols from nm output
-# Format: _u_boot_list_2_ut_<suite>_2_<test>
-RE_TEST_ALL = re.compile(r'_u_boot_list_2_ut_(\w+?)_2_(\w+)')
-RE_TEST_SUITE = r'_u_boot_list_2_ut_{}_2_(\w+)'
+# Tests and suites in the sandbox executable
+# suites: sorted tuple of suite names
+# tests: dict of sorted test names for each suite, in suite order
+SymbolIndex = namedtuple('SymbolIndex', ['suites', 'tests'])
+
+# Patterns for parsing symbols from 'nm -P' output, which is kept as bytes.
+# Each line starts with the symbol name, followed by a space. The patterns
+# start with a literal newline rather than '^', since that lets the regex
+# engine skip quickly to each line. RE_SYMBOL reads both suites and tests in
+# a single pass.
+# Format: _u_boot_list_2_ut_<suite>_2_<test> or suite_end_<suite>
+RE_SYMBOL = re.compile(
+    rb'\n(?:_u_boot_list_2_ut_(\w+?)_2_(\w+)|suite_end_(\w+)) ')
+RE_TEST_SUITE = r'\n_u_boot_list_2_ut_{}_2_(\w+) D ([0-9a-f]+)'
+
+# Symbol-name prefixes, used when reading the symbol table directly
+TEST_PREFIX = '_u_boot_list_2_ut_'
+SUITE_END = 'suite_end_'
 
 # Pattern for parsing .data.rel.ro section from readelf output
 RE_DATA_REL_RO = re.compile(
     r'\.data\.rel\.ro\s+PROGBITS\s+([0-9a-f]+)\s+([0-9a-f]+)')
 
-# Patterns for parsing test output
-RE_TEST_NAME = re.compile(r'Test:\s*(\S+)')
-RE_RESULT = re.compile(r'Result:\s*(PASS|FAIL|SKIP):?\s+(\S+)')
+# Colour used to show each result status
+STATUS_COLOR = {
+    'PASS': terminal.Color.GREEN,
+    'FAIL': terminal.Color.RED,
+    'SKIP': terminal.Color.YELLOW,
+}
+
+# Prefixes of the first line of test output, after the U-Boot banner
+TEST_START = ('Running ', 'Test: ', 'Missing ')
+RE_TEST_START = re.compile(f"^(?:{'|'.join(TEST_START)})", re.MULTILINE)
+
+# Characters which make a test argument a glob pattern
+RE_GLOB = re.compile(r'[*?[]')
+
+# Patterns for parsing test output, each scanning the whole output at once.
+# These start with a literal so that the regex engine can skip quickly to
+# each candidate, rather than trying the pattern at every position
+# Legacy format: Test: <name> ... ok/FAILED/SKIPPED. RE_LEGACY captures only
+# the status, which may be anywhere in the line. The name is looked for with
+# RE_TEST_NAME only on lines with a status
+RE_LEGACY = re.compile(r'\.\.\. (ok|failed|skipped)', re.IGNORECASE)
+RE_TEST_NAME = re.compile(r'Test:[ \t]*(\S+)')
+# Status for each legacy result word, keyed by its first letter in either case
+LEGACY_STATUS = {'o': 'PASS', 'O': 'PASS', 'f': 'FAIL', 'F': 'FAIL',
+                 's': 'SKIP', 'S': 'SKIP'}
+# Result lines, matched after a newline, so the output needs a leading one
+RE_RESULT = re.compile(r'\nResult:[ \t]*(PASS|FAIL|SKIP):?[ \t]+(\S+)')
 
 # Unit test flags from include/test/test.h
 UTF_FLAT_TREE = 0x08
 UTF_LIVE_TREE = 0x10
 UTF_DM = 0x80
 
+# Flags field of struct unit_test, which follows the file, name and func
+# pointers
+UNIT_TEST_FLAGS = struct.Struct('<24xI')
+
+
+@functools.lru_cache(maxsize=64)
+def get_suite_re(suite):
+    """Get a compiled pattern matching the tests in a suite in nm output
+
+    Args:
+        suite (str): Suite name
+
+    Returns:
+        re.Pattern: Compiled bytes pattern, where each match is a
+            (name, addr) tuple
+    """
+    return re.compile(RE_TEST_SUITE.format(re.escape(suite)).encode())
+
 
 def get_sandbox_path():
     """Get path to the sandbox U-Boot executable
@@ -57,6 +122,106 @@ def get_sandbox_path():
     return None
 
 
+def get_file_stamp(path):
+    """Get a value which changes whenever a file is rebuilt
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        tuple or None: (mtime_ns, size), or None if the file cannot be read
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+@functools.lru_cache(maxsize=4)
+def run_nm(sandbox, stamp):  # pylint: disable=W0613
+    """Get the symbols in the sandbox executable
+
+    The output is cached, since several callers need it and nm takes a while
+    on a large binary. The stamp is part of the key so that a rebuild is
+    picked up.
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        stamp (tuple): File stamp from get_file_stamp()
+
+    Returns:
+        bytes: Output from nm, left undecoded since it can be large and only
+            the matching symbols are needed. A newline is added at the start
+            so that every symbol follows one.
+    """
+    return b'\n' + command.run_one('nm', '--defined-only', '-P', sandbox,
+                                   capture=True, binary=True).stdout
+
+
+@functools.lru_cache(maxsize=4)
+def run_readelf(sandbox, stamp):  # pylint: disable=W0613
+    """Get the section headers of the sandbox executable
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        stamp (tuple): File stamp from get_file_stamp()
+
+    Returns:
+        str: Output from 'readelf -S'
+    """
+    return command.run_one('readelf', '-S', sandbox, capture=True).stdout
+
+
+@functools.lru_cache(maxsize=4)
+def read_symbols(sandbox, stamp):  # pylint: disable=W0613
+    """Get the symbols in the sandbox executable using pyelftools
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        stamp (tuple): File stamp from get_file_stamp()
+
+    Returns:
+        dict: Address of each symbol in the symbol table, keyed by name
+    """
+    with open(sandbox, 'rb') as fh:
+        symtab = ELFFile(fh).get_section_by_name('.symtab')
+        if not symtab:
+            return {}
+        return {sym.name: sym['st_value'] for sym in symtab.iter_symbols()}
+
+
+@functools.lru_cache(maxsize=4)
+def read_section(sandbox, stamp, name):  # pylint: disable=W0613
+    """Get the address and contents of a section using pyelftools
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        stamp (tuple): File stamp from get_file_stamp()
+        name (str): Section name, e.g. '.data.rel.ro'
+
+    Returns:
+        tuple: (addr, data), or (None, None) if there is no such section
+    """
+    with open(sandbox, 'rb') as fh:
+        section = ELFFile(fh).get_section_by_name(name)
+        if not section:
+            return None, None
+        return section['sh_addr'], section.data()
+
+
+def get_nm_output(sandbox):
+    """Get the (possibly cached) nm output for the sandbox executable
+
+    Args:
+        sandbox (str): Path to sandbox executable
+
+    Returns:
+        bytes: Output from nm
+    """
+    return run_nm(sandbox, get_file_stamp(sandbox))
+
+
 def get_section_info(sandbox):
     """Get .data.rel.ro section address and file offset
 
@@ -66,13 +231,46 @@ def get_section_info(sandbox):
     Returns:
         tuple: (section_addr, section_offset) or (None, None) if not found
     """
-    result = command.run_one('readelf', '-S', sandbox, capture=True)
-    match = RE_DATA_REL_RO.search(result.stdout)
+    output = run_readelf(sandbox, get_file_stamp(sandbox))
+    match = RE_DATA_REL_RO.search(output)
     if match:
         return int(match.group(1), 16), int(match.group(2), 16)
     return None, None
 
 
+def get_test_flags_elf(sandbox, suite):
+    """Get flags for all tests in a suite using pyelftools
+
+    This reads the symbol table and the .data.rel.ro section directly,
+    avoiding the need to run nm and readelf. Both are cached, so only the
+    suite's own symbols are looked at for each suite.
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        suite (str): Suite name to get flags for
+
+    Returns:
+        list: List of (test_name, flags) tuples
+    """
+    stamp = get_file_stamp(sandbox)
+    base, data = read_section(sandbox, stamp, '.data.rel.ro')
+    if data is None:
+        return []
+    symbols = read_symbols(sandbox, stamp)
+    prefix = f'{TEST_PREFIX}{suite}_2_'
+    test_flags = []
+    for name in read_index(sandbox, stamp).tests.get(suite, []):
+        addr = symbols.get(prefix + name)
+        if addr is None:
+            continue
+        offset = addr - base
+        if offset < 0 or offset + UNIT_TEST_FLAGS.size > len(data):
+            continue
+        flags, = UNIT_TEST_FLAGS.unpack_from(data, offset)
+        test_flags.append((name, flags))
+    return test_flags
+
+
 def get_test_flags(sandbox, suite):
     """Get flags for all tests in a suite by parsing the binary
 
@@ -93,10 +291,11 @@ def get_test_flags(sandbox, suite):
     Returns:
         list: List of (test_name, flags) tuples
     """
+    if ELFTOOLS_AVAILABLE:
+        return get_test_flags_elf(sandbox, suite)
+
     # Get symbol addresses
-    result = command.run_one('nm', sandbox, capture=True)
-    pattern = rf'([0-9a-f]+) D _u_boot_list_2_ut_{suite}_2_(\w+)'
-    tests = re.findall(pattern, result.stdout)
+    tests = get_suite_re(suite).findall(get_nm_output(sandbox))
 
     if not tests:
         return []
@@ -105,17 +304,17 @@ def get_test_flags(sandbox, suite):
     if section_addr is None:
         return []
 
+    # Map the file so that each struct can be unpacked in place
     test_flags = []
-    with open(sandbox, 'rb') as fh:
-        for addr_str, name in tests:
-            addr = int(addr_str, 16)
-            file_offset = section_offset + (addr - section_addr)
-            fh.seek(file_offset)
-            data = fh.read(28)
-            if len(data) < 28:
+    with open(sandbox, 'rb') as fh, mmap.mmap(fh.fileno(), 0,
+                                             access=mmap.ACCESS_READ) as data:
+        for name, addr_str in tests:
+            file_offset = section_offset + (int(addr_str, 16) - section_addr)
+            if (file_offset < 0 or
+                    file_offset + UNIT_TEST_FLAGS.size > len(data)):
                 continue
-            _, _, _, flags = struct.unpack('<QQQI', data)
-            test_flags.append((name, flags))
+            flags, = UNIT_TEST_FLAGS.unpack_from(data, file_offset)
+            test_flags.append((name.decode(), flags))
 
     return test_flags
 
@@ -132,22 +331,23 @@ def predict_test_count(sandbox, suite, full=False):
         int: Predicted number of test runs
     """
     test_flags = get_test_flags(sandbox, suite)
-    if not test_flags:
-        return 0
+
+    # Without full, each test runs once unless it is flat-tree only
+    if not full:
+        return sum(1 for _, flags in test_flags if not flags & UTF_FLAT_TREE)
 
     count = 0
     for name, flags in test_flags:
-        # Tests with UTF_FLAT_TREE only run on flat tree (skip unless full)
+        # Tests with UTF_FLAT_TREE only run on flat tree
         if flags & UTF_FLAT_TREE:
-            if full:
-                count += 1
+            count += 1
             continue
 
         # All other tests run once on live tree
         count += 1
 
-        # Tests with UTF_DM run again on flat tree (only if full)
-        if full and flags & UTF_DM and not flags & UTF_LIVE_TREE:
+        # Tests with UTF_DM run again on flat tree
+        if flags & UTF_DM and not flags & UTF_LIVE_TREE:
             # Video tests skip flattree (except video_base)
             if 'video' not in name or 'video_base' in name:
                 count += 1
@@ -157,6 +357,7 @@ def predict_test_count(sandbox, suite, full=False):
 
 # Tests that require test_ut_dm_init to create data files
 HOST_TESTS = ['cmd_host', 'host', 'host_dup']
+RE_HOST_TEST = re.compile('|'.join(HOST_TESTS))
 
 
 def needs_dm_init(specs):
@@ -173,10 +374,8 @@ def needs_dm_init(specs):
         if suite in ('dm', 'all'):
             return True
         # Check for specific host tests
-        if pattern:
-            for host_test in HOST_TESTS:
-                if host_test in pattern:
-                    return True
+        if pattern and RE_HOST_TEST.search(pattern):
+            return True
     return False
 
 
@@ -200,8 +399,84 @@ def ensure_dm_init_files():
     return True
 
 
+def scan_symbols(sandbox, stamp):
+    """Scan the symbols in the sandbox executable for suites and unit tests
+
+    This makes a single pass over the symbols, collecting both.
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        stamp (tuple): File stamp from get_file_stamp()
+
+    Returns:
+        SymbolIndex: Suites and tests
+    """
+    suites = set()
+    tests = defaultdict(set)
+    if ELFTOOLS_AVAILABLE:
+        for name in read_symbols(sandbox, stamp):
+            if name.startswith(TEST_PREFIX):
+                rest = name[len(TEST_PREFIX):]
+                suite, sep, test = rest.partition('_2_')
+                if sep:
+                    tests[suite].add(test)
+            elif name.startswith(SUITE_END):
+                suites.add(name[len(SUITE_END):])
+    else:
+        output = run_nm(sandbox, stamp)
+        for suite, test, end in set(RE_SYMBOL.findall(output)):
+            if end:
+                suites.add(end.decode())
+            else:
+                tests[suite.decode()].add(test.decode())
+    return SymbolIndex(
+        tuple(sorted(suites)),
+        {suite: sorted(names) for suite, names in sorted(tests.items())})
+
+
+@functools.lru_cache(maxsize=4)
+def read_index(sandbox, stamp):
+    """Get an index of the suites and unit tests in the sandbox executable
+
+    The index is kept in ~/.cache/uman so that later runs against the same
+    build of sandbox can skip reading its symbols.
+
+    Args:
+        sandbox (str): Path to sandbox executable
+        stamp (tuple): File stamp from get_file_stamp()
+
+    Returns:
+        SymbolIndex: Suites and tests
+    """
+    key = f'{sandbox}|{stamp[0]}|{stamp[1]}' if stamp else None
+    cached = read_cache('symbols.json', key) if key else None
+    if cached:
+        try:
+            return SymbolIndex(tuple(cached['suites']), cached['tests'])
+        except (KeyError, TypeError):
+            pass
+
+    index = scan_symbols(sandbox, stamp)
+    if key:
+        write_cache('symbols.json', key,
+                    {'suites': index.suites, 'tests': index.tests})
+    return index
+
+
+def get_index(sandbox):
+    """Get the (possibly cached) index for the sandbox executable
+
+    Args:
+        sandbox (str): Path to sandbox executable
+
+    Returns:
+        SymbolIndex: Suites and tests
+    """
+    return read_index(sandbox, get_file_stamp(sandbox))
+
+
 def get_suites_from_nm(sandbox):
-    """Get available test suites by parsing nm output
+    """Get available test suites from the symbols in sandbox
 
     Looks for symbols matching 'suite_end_<name>' pattern.
 
@@ -211,13 +486,11 @@ def get_suites_from_nm(sandbox):
     Returns:
         list: Sorted list of suite names
     """
-    result = command.run_one('nm', sandbox, capture=True)
-    suites = re.findall(r'\bsuite_end_(\w+)', result.stdout)
-    return sorted(set(suites))
+    return list(get_index(sandbox).suites)
 
 
 def get_tests_from_nm(sandbox, suite=None):
-    """Get available tests by parsing nm output
+    """Get available tests from the symbols in sandbox
 
     U-Boot uses linker lists to register unit tests. Each test creates a
     symbol with the pattern '_u_boot_list_2_ut_<suite>_2_<test>', where
@@ -230,14 +503,10 @@ def get_tests_from_nm(sandbox, suite=None):
     Returns:
         list: Sorted list of (suite, test) tuples, e.g. [('dm', 'test_acpi')]
     """
-    result = command.run_one('nm', sandbox, capture=True)
+    index = get_index(sandbox).tests
     if suite:
-        matches = re.findall(RE_TEST_SUITE.format(suite), result.stdout)
-        return sorted(set((suite, test) for test in matches))
-
-    # Find all tests across all suites
-    matches = RE_TEST_ALL.findall(result.stdout)
-    return sorted(set(matches))
+        return [(suite, test) for test in index.get(suite, [])]
+    return [(name, test) for name, tests in index.items() for test in tests]
 
 
 def parse_one_test(arg):
@@ -266,19 +535,22 @@ def parse_one_test(arg):
             return (suite, pattern)
 
     # Check for suite.test format
-    if '.' in suite and pattern is None:
-        suite, pattern = suite.split('.', 1)
+    head, sep, tail = suite.partition('.')
+    if sep and pattern is None:
+        return (head, tail)
+
     # Check for full test name: suite_test_name
-    elif '_test_' in suite:
-        suite, pattern = suite.split('_test_', 1)
+    head, sep, tail = suite.partition('_test_')
+    if sep:
+        return (head, tail)
+
     # Check for test name only: test_something -> search all suites
-    elif suite.startswith('test_'):
-        pattern = suite[5:]  # Strip 'test_' prefix
-        suite = None
+    if suite.startswith('test_'):
+        return (None, suite[5:])  # Strip 'test_' prefix
+
     # Check for partial test name containing underscore (e.g. ext4l_unlink)
-    elif '_' in suite and pattern is None:
-        pattern = suite
-        suite = None
+    if '_' in suite and pattern is None:
+        return (None, suite)
 
     return (suite, pattern)
 
@@ -310,77 +582,84 @@ def parse_test_specs(tests):
 
     # Two args: could be suite+pattern or two suites/tests
     # If second arg contains glob chars, treat as pattern
-    if len(tests) == 2 and any(c in tests[1] for c in '*?['):
+    if len(tests) == 2 and RE_GLOB.search(tests[1]):
         return [(tests[0], tests[1])]
 
     # Multiple suites or full test names
     return [parse_one_test(t) for t in tests]
 
 
-def resolve_specs(sandbox, specs):
-    """Resolve specs with suite=None by looking up from nm
+def make_suffix_index(all_tests):
+    """Build an index for finding tests by the end of their name
 
     Args:
-        sandbox (str): Path to sandbox executable
-        specs (list): List of (suite, pattern) tuples
+        all_tests (list): List of (suite, test) tuples
 
     Returns:
-        tuple: (resolved_specs, unmatched_specs)
+        list: Sorted list of (reversed test name, suite) tuples
     """
-    resolved = []
-    unmatched = []
-    all_tests = None  # Lazy load
+    return sorted((name[::-1], suite) for suite, name in all_tests)
 
-    for suite, pattern in specs:
-        if suite is not None:
-            resolved.append((suite, pattern))
-        else:
-            # Need to find suite(s) for this pattern
-            if all_tests is None:
-                all_tests = get_tests_from_nm(sandbox)
-            found = False
-            for test_suite, test_name in all_tests:
-                if test_name.endswith(pattern):
-                    resolved.append((test_suite, pattern))
-                    found = True
-                    break  # Only add first match
-            if not found:
-                unmatched.append((None, pattern))
 
-    return resolved, unmatched
+def find_suites(index, pattern):
+    """Find the suites with a test whose name ends with a pattern
+
+    Args:
+        index (list): Index from make_suffix_index()
+        pattern (str): End of the test name to look for
+
+    Returns:
+        list of str: Matching suites in sorted order, empty if none
+    """
+    rev = pattern[::-1]
+    pos = bisect.bisect_left(index, (rev,))
+    suites = set()
+    while pos < len(index) and index[pos][0].startswith(rev):
+        suites.add(index[pos][1])
+        pos += 1
+    return sorted(suites)
+
 
+def check_specs(sandbox, specs):
+    """Resolve specs with suite=None and check that each matches a test
 
-def validate_specs(sandbox, specs):
-    """Check that each spec matches at least one test
+    The tests are read from sandbox once and used for both steps.
 
     Args:
         sandbox (str): Path to sandbox executable
         specs (list): List of (suite, pattern) tuples
 
     Returns:
-        list: List of unmatched specs (empty if all match)
+        tuple: (resolved_specs, unmatched_specs), where an unmatched spec has
+            a suite of None if no suite could be found for its pattern
     """
     if specs == [('all', None)]:
-        return []
+        return specs, []
 
     all_tests = get_tests_from_nm(sandbox)
-    unmatched = []
+    known = {suite for suite, _ in all_tests}
+    index = None  # Lazy load
 
+    resolved = []
+    unmatched = []
     for suite, pattern in specs:
-        found = False
-        for test_suite, test_name in all_tests:
-            if test_suite != suite:
-                continue
-            if pattern is None:
-                found = True
-                break
-            if test_name.endswith(pattern):
-                found = True
-                break
-        if not found:
+        if pattern is None:
+            found = suite in known
+        else:
+            if index is None:
+                index = make_suffix_index(all_tests)
+            suites = find_suites(index, pattern)
+
+            # Use the first suite for a pattern without one
+            if suite is None and suites:
+                suite = suites[0]
+            found = suite in suites
+        if found:
+            resolved.append((suite, pattern))
+        else:
             unmatched.append((suite, pattern))
 
-    return unmatched
+    return resolved, unmatched
 
 
 def build_ut_cmd(sandbox, specs, full=False, verbose=False, legacy=False,
@@ -427,21 +706,21 @@ def build_ut_cmd(sandbox, specs, full=False, verbose=False, legacy=False,
     return cmd
 
 
-def show_result(status, name, col):
-    """Print a test result if showing results
+def print_results(results, col):
+    """Print per-test results
+
+    The lines are joined and printed in one go, since there can be
+    thousands of them.
 
     Args:
-        status (str): Result status (PASS, FAIL, SKIP)
-        name (str): Test name
+        results (list): List of (status, name) tuples, where status is PASS,
+            FAIL or SKIP
         col (terminal.Color): Color object for output
     """
-    if status == 'PASS':
-        color = terminal.Color.GREEN
-    elif status == 'FAIL':
-        color = terminal.Color.RED
-    else:
-        color = terminal.Color.YELLOW
-    print(f'  {col.start(color)}{status}{col.stop()}: {name}')
+    labels = {status: f'  {col.start(color)}{status}{col.stop()}: '
+              for status, color in STATUS_COLOR.items()}
+    if results:
+        print('\n'.join(labels[status] + name for status, name in results))
 
 
 def parse_legacy_results(output, show_results=False, col=None):
@@ -457,32 +736,31 @@ def parse_legacy_results(output, show_results=False, col=None):
     Returns:
         TestCounts or None: Counts of passed/failed/skipped, or None if none
     """
-    passed = 0
-    failed = 0
-    skipped = 0
-
-    for line in output.splitlines():
-        name_match = RE_TEST_NAME.search(line)
-        name = name_match.group(1) if name_match else None
-        lower = line.lower()
-
-        if '... ok' in lower:
-            status = 'PASS'
-            passed += 1
-        elif '... failed' in lower:
-            status = 'FAIL'
-            failed += 1
-        elif '... skipped' in lower:
-            status = 'SKIP'
-            skipped += 1
-        else:
-            continue
-        if show_results and name:
-            show_result(status, name, col)
-
-    if not passed and not failed and not skipped:
+    counts = dict.fromkeys(LEGACY_STATUS.values(), 0)
+    results = []
+    match = RE_LEGACY.search(output)
+    while match:
+        end = output.find('\n', match.end())
+        if end == -1:
+            end = len(output)
+
+        # Count each line once: ok wins over failed, which wins over skipped
+        found = {LEGACY_STATUS[word[0]]
+                 for word in RE_LEGACY.findall(output, match.start(), end)}
+        status = next(status for status in counts if status in found)
+        counts[status] += 1
+        if show_results:
+            start = output.rfind('\n', 0, match.start()) + 1
+            name = RE_TEST_NAME.search(output, start, end)
+            if name:
+                results.append((status, name.group(1)))
+        match = RE_LEGACY.search(output, end)
+    if show_results:
+        print_results(results, col)
+
+    if not any(counts.values()):
         return None
-    return TestCounts(passed, failed, skipped)
+    return TestCounts(counts['PASS'], counts['FAIL'], counts['SKIP'])
 
 
 def parse_results(output, show_results=False, col=None):
@@ -496,26 +774,58 @@ def parse_results(output, show_results=False, col=None):
     Returns:
         TestCounts or None: Counts of passed/failed/skipped, or None if none
     """
-    passed = 0
-    failed = 0
-    skipped = 0
-
-    for line in output.splitlines():
-        result_match = RE_RESULT.match(line)
-        if result_match:
-            status, name = result_match.groups()
-            if status == 'PASS':
-                passed += 1
-            elif status == 'FAIL':
-                failed += 1
-            elif status == 'SKIP':
-                skipped += 1
-            if show_results:
-                show_result(status, name, col)
-
-    if not passed and not failed and not skipped:
+    results = RE_RESULT.findall('\n' + output)
+    if not results:
         return None
-    return TestCounts(passed, failed, skipped)
+    if show_results:
+        print_results(results, col)
+
+    counts = Counter(status for status, _ in results)
+    return TestCounts(counts['PASS'], counts['FAIL'], counts['SKIP'])
+
+
+class OutputFilter:
+    """Print sandbox test output, skipping the U-Boot banner
+
+    An instance can be passed as the output_func for command.run_one(), to
+    show the output as it arrives.
+    """
+    def __init__(self):
+        self.in_tests = False
+        self.partial = b''
+
+    def show_line(self, line):
+        """Print a line of output if the tests have started
+
+        Args:
+            line (str): Line to show, without a trailing newline
+        """
+        if not self.in_tests:
+            if line.startswith(TEST_START):
+                self.in_tests = True
+        if self.in_tests:
+            print(line)
+
+    def __call__(self, _stream, data):
+        """Handle a fragment of output from sandbox
+
+        Args:
+            _stream (file): Stream the output was received on (unused)
+            data (bytes): Output data
+
+        Returns:
+            bool: False, so that the process is not terminated
+        """
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.show_line(line.decode('utf-8', errors='replace').rstrip('\r'))
+        return False
+
+    def flush(self):
+        """Show any final line which had no trailing newline"""
+        if self.partial:
+            self(None, b'\n')
 
 
 def run_tests(sandbox, specs, args, col):  # pylint: disable=R0914
@@ -545,9 +855,17 @@ def run_tests(sandbox, specs, args, col):  # pylint: disable=R0914
     env = os.environ.copy()
     env['U_BOOT_PERSISTENT_DATA_DIR'] = persist_dir
 
+    # In verbose mode, show the output as it arrives rather than at the end.
+    # With an output_func, run_one() reads through a PTY, so lines end in
+    # '\r\n' and the result patterns must allow for that
+    live = None
+    if args.test_verbose and not args.results:
+        live = OutputFilter()
+
     start_time = time.time()
     try:
-        result = command.run_one(*cmd, capture=True, env=env)
+        result = command.run_one(*cmd, capture=True, env=env,
+                                 output_func=live)
     except command.CommandExc as exc:
         # Tests may fail but still produce parseable output
         result = exc.result
@@ -557,6 +875,8 @@ def run_tests(sandbox, specs, args, col):  # pylint: disable=R0914
             tout.error(f'Command failed: {exc}')
             return 1
     elapsed = time.time() - start_time
+    if live:
+        live.flush()
 
     # Detect old U-Boot that doesn't understand -F flag
     if 'failed while parsing option: -F' in result.stdout:
@@ -569,17 +889,14 @@ def run_tests(sandbox, specs, args, col):  # pylint: disable=R0914
         res = parse_legacy_results(result.stdout, show_results=args.results,
                                    col=col)
 
-    # Print output in verbose mode, if there are failures, or no results
-    if result.stdout and not args.results:
-        if args.test_verbose or (res and res.failed) or not res:
+    # Print output if there are failures or no results, unless already shown
+    if result.stdout and not args.results and not live:
+        if (res and res.failed) or not res:
             # Skip U-Boot banner, show only test output
-            in_tests = False
-            for line in result.stdout.splitlines():
-                if not in_tests:
-                    if line.startswith(('Running ', 'Test: ', 'Missing ')):
-                        in_tests = True
-                if in_tests:
-                    print(line)
+            match = RE_TEST_START.search(result.stdout)
+            if match:
+                tail = result.stdout[match.start():]
+                print(tail, end='' if tail.endswith('\n') else '\n')
     if res:
         show_summary(res.passed, res.failed, res.skipped, elapsed)
         return result.return_code
@@ -632,18 +949,13 @@ def do_test(args):  # pylint: disable=R0912
     # Parse test specs
     specs = parse_test_specs(args.tests)
 
-    # Resolve any specs that need suite lookup
-    specs, unmatched = resolve_specs(sandbox, specs)
-    if unmatched:
-        for suite, pattern in unmatched:
-            tout.error(f'No tests found matching: {pattern}')
-        return 1
-
-    # Validate that specs match actual tests
-    unmatched = validate_specs(sandbox, specs)
+    # Resolve any specs that need suite lookup and check that all match
+    specs, unmatched = check_specs(sandbox, specs)
     if unmatched:
         for suite, pattern in unmatched:
-            if pattern:
+            if not suite:
+                tout.error(f'No tests found matching: {pattern}')
+            elif pattern:
                 tout.error(f'No tests found matching: {suite}.{pattern}')
             else:
                 tout.error(f'No tests found in suite: {suite}')
@@ -27,6 +27,7 @@ from uman_pkg.util import exec_cmd
 # - uman_pkg.cmdconfig: run_command() for 'config'
 # - uman_pkg.cmdgit: run_command() for 'git'
 # - uman_pkg.cmdpy: run_command() for 'pytest'
+# - uman_pkg.pollute: run_command() for 'pytest --pollute'
 # - uman_pkg.cmdtest: run_command() for 'test'
 # - uman_pkg.setup: run_command() for 'setup'
 
@@ -323,6 +324,9 @@ def run_command(args):  # pylint: disable=R0911
         return cmdgit.run(args)
 
     if args.cmd == 'pytest':
+        if args.pollute:
+            from uman_pkg.pollute import do_pollute
+            return do_pollute(args)
         from uman_pkg.cmdpy import do_pytest
         return do_pytest(args)
 
@@ -11,7 +11,9 @@ import ast
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
+import threading
 import unittest
 from unittest import mock
 
@@ -22,7 +24,7 @@ from u_boot_pylib import tout
 import gitlab
 
 from uman_pkg import (build, cmdconfig, cmdgit, cmdline, cmdpy, cmdtest,
-                      control, gitlab_parser, settings, setup, util)
+                      control, gitlab_parser, pollute, settings, setup, util)
 
 # Capture stdout and stderr for silent command execution
 CAPTURE = {'capture': True, 'capture_stderr': True}
@@ -64,6 +66,15 @@ class TestBase(unittest.TestCase):
     def tearDown(self):
         """Clean up and restore command.TEST_RESULT after each test"""
         command.TEST_RESULT = None
+        util.find_uboot_dir.cache_clear()
+        cmdpy.get_test_files.cache_clear()
+        cmdpy.path_exists.cache_clear()
+        cmdpy.get_hostname.cache_clear()
+        cmdtest.run_nm.cache_clear()
+        cmdtest.run_readelf.cache_clear()
+        cmdtest.read_symbols.cache_clear()
+        cmdtest.read_section.cache_clear()
+        cmdtest.read_index.cache_clear()
         if self.test_dir and os.path.exists(self.test_dir):
             shutil.rmtree(self.test_dir)
 
@@ -91,19 +102,24 @@ def make_args(**kwargs):
         'list_boards': False,
         'lto': False,
         'merge': False,
+        'no_cache': False,
         'no_timeout': False,
         'null': False,
         'persist': False,
         'pollute': None,
+        'pollute_jobs': 1,
+        'pollute_timeout': None,
         'pytest': None,
         'quiet': False,
         'setup_only': False,
+        'shard': None,
         'show_cmd': False,
         'show_output': False,
         'sjg': None,
         'suites': False,
         'test_spec': [],
         'timing': None,
+        'trust_target': False,
         'verbose': False,
         'world': False,
     }
@@ -2273,6 +2289,27 @@ class TestUmanControl(TestBase):  # pylint: disable=too-many-public-methods
             elif 'b' in os.environ:
                 del os.environ['b']
 
+    def test_get_build_dir(self):
+        """Test get_build_dir uses --build-dir or the configured base"""
+        args = make_args(board='sandbox')
+        with mock.patch.object(settings, 'get', return_value='/tmp/b'):
+            self.assertEqual('/tmp/b/sandbox', cmdpy.get_build_dir(args))
+            self.assertEqual('/tmp/b/qemu-x86',
+                             cmdpy.get_build_dir(args, 'qemu-x86'))
+            self.assertEqual('/tmp/b/sandbox-pollute',
+                             cmdpy.get_build_dir(args, suffix='-pollute'))
+        args.build_dir = '/my/dir'
+        self.assertEqual('/my/dir',
+                         cmdpy.get_build_dir(args, suffix='-pollute'))
+
+    def test_pytest_spec_separator(self):
+        """Test that : and :: in a test spec become 'and' for -k"""
+        for spec in ('TestFs:test_ext4', 'TestFs::test_ext4'):
+            args = make_args(board='sandbox', test_spec=[spec])
+            cmd = cmdpy.build_pytest_cmd(args)
+            self.assertEqual('TestFs and test_ext4',
+                             cmd[cmd.index('-k') + 1])
+
     def test_pytest_quiet_mode(self):
         """Test that quiet mode adds correct flags"""
         cap = []
@@ -2291,6 +2328,40 @@ class TestUmanControl(TestBase):  # pylint: disable=too-many-public-methods
         self.assertIn('--no-header', cmd)
         self.assertIn('--quiet-hooks', cmd)
 
+    def test_pytest_exec(self):
+        """Test that quiet full runs replace uman with pytest"""
+        args = make_args(cmd='pytest', board='sandbox', quiet=True, full=True)
+        calls = []
+
+        def mock_execvpe(*_args):
+            calls.append('exec')
+            raise SystemExit(0)
+
+        def flush(name):
+            return lambda: calls.append(name)
+
+        with mock.patch.object(os, 'execvpe',
+                               side_effect=mock_execvpe) as mock_exec:
+            with mock.patch('subprocess.run') as mock_run:
+                with self.assertRaises(SystemExit):
+                    with terminal.capture() as (out, err):
+                        with mock.patch.object(sys.stdout, 'flush',
+                                               side_effect=flush('stdout')):
+                            with mock.patch.object(sys.stderr, 'flush',
+                                                   side_effect=flush('stderr')):
+                                control.run_command(args)
+        self.assertFalse(out.getvalue())
+        self.assertFalse(err.getvalue())
+
+        # Output is flushed before pytest replaces uman
+        self.assertEqual(['stdout', 'stderr', 'exec'], calls)
+        mock_exec.assert_called_once()
+        cmd = mock_exec.call_args[0][1]
+        self.assertEqual(mock_exec.call_args[0][0], cmd[0])
+        self.assertNotIn('--no-full', cmd)
+        self.assertIn('sandbox', cmd)
+        mock_run.assert_not_called()
+
     def test_pytest_no_full_unsupported(self):
         """Test do_pytest detects --no-full not supported"""
 
@@ -2336,6 +2407,34 @@ class TestUmanControl(TestBase):  # pylint: disable=too-many-public-methods
         # First command should be buildman without -L (LTO enabled)
         self.assertNotIn('-L', cap[0])
 
+    def test_pytest_build_clears_path_cache(self):
+        """Test that paths created by the build are seen afterwards"""
+        new_dir = os.path.join(self.test_dir, 'made-by-build')
+
+        def mock_build(*_args):
+            self.assertFalse(cmdpy.path_exists(new_dir))
+            os.mkdir(new_dir)
+            return True
+
+        args = make_args(cmd='pytest', board='sandbox', build=True)
+        with mock.patch.object(cmdpy.build_mod, 'build_board', mock_build):
+            with mock.patch('subprocess.run',
+                            return_value=subprocess.CompletedProcess([], 0)):
+                with terminal.capture():
+                    control.run_command(args)
+        self.assertTrue(cmdpy.path_exists(new_dir))
+
+    def test_pytest_clears_path_cache(self):
+        """Test that each pytest command starts with an empty path cache"""
+        new_dir = os.path.join(self.test_dir, 'made-later')
+        self.assertFalse(cmdpy.path_exists(new_dir))
+        os.mkdir(new_dir)
+
+        args = make_args(cmd='pytest', board='sandbox', list_boards=True)
+        with mock.patch.object(cmdpy, 'list_boards', return_value=0):
+            control.run_command(args)
+        self.assertTrue(cmdpy.path_exists(new_dir))
+
     def test_pytest_find_flag(self):
         """Test -F/--find flag for pytest"""
         args = cmdline.parse_args(['pytest', '-B', 'sandbox', '-F', 'video'])
@@ -2377,6 +2476,113 @@ class TestUmanControl(TestBase):  # pylint: disable=too-many-public-methods
         self.assertEqual(1, res)
         self.assertIn("No tests matching 'nonexistent'", err.getvalue())
 
+    def test_pytest_gdb_skips_env(self):
+        """Test -G launches gdb without setting up the pytest environment"""
+        args = make_args(cmd='pytest', board='sandbox', gdb=True)
+        with mock.patch.object(cmdpy, 'run_with_gdb',
+                               return_value=0) as mock_gdb:
+            with mock.patch.object(cmdpy, 'pytest_env') as mock_env:
+                with terminal.capture():
+                    res = control.run_command(args)
+        self.assertEqual(0, res)
+        mock_gdb.assert_called_once_with(args)
+        mock_env.assert_not_called()
+
+    def test_pytest_env_uboot_dir(self):
+        """Test pytest_env uses the U-Boot directory passed in"""
+        os.makedirs('test/hooks/bin')
+        with mock.patch.object(cmdpy, 'get_uboot_dir') as mock_dir:
+            with mock.patch.object(settings, 'get', return_value=None):
+                env = cmdpy.pytest_env('sandbox', self.test_dir)
+        mock_dir.assert_not_called()
+        self.assertEqual(
+            f"{self.test_dir}/test/hooks/bin:{os.environ.get('PATH', '')}",
+            env['PATH'])
+
+    def test_pytest_plugin_args(self):
+        """Test unused pytest plugins are disabled unless needed"""
+        self.assertEqual(['-p', 'no:cacheprovider', '-p', 'no:stepwise',
+                          '-p', 'no:junitxml', '-p', 'no:doctest'],
+                         cmdpy.plugin_args([]))
+        self.assertEqual(['-p', 'no:stepwise', '-p', 'no:doctest'],
+                         cmdpy.plugin_args(['--lf', '--junitxml=out.xml']))
+        self.assertEqual(['-p', 'no:junitxml', '-p', 'no:doctest'],
+                         cmdpy.plugin_args(['--sw']))
+
+    def test_pytest_parse_shard(self):
+        """Test parsing of --shard values"""
+        self.assertEqual((0, 4), cmdpy.parse_shard('0/4'))
+        self.assertEqual((3, 4), cmdpy.parse_shard('3/4'))
+        self.assertIsNone(cmdpy.parse_shard('4/4'))
+        self.assertIsNone(cmdpy.parse_shard('1'))
+        self.assertIsNone(cmdpy.parse_shard('a/4'))
+        self.assertIsNone(cmdpy.parse_shard('0/0'))
+
+    def test_pytest_shard_tests(self):
+        """Test that shards partition the tests without overlap"""
+        tests = [f'test_ut.py::test_ut[ut_dm_{i}]' for i in range(50)]
+        shards = [cmdpy.shard_tests(tests, i, 3) for i in range(3)]
+        self.assertEqual(sorted(tests), sorted(sum(shards, [])))
+        for shard in shards:
+            self.assertTrue(shard)
+        self.assertEqual(shards[1], cmdpy.shard_tests(tests, 1, 3))
+
+    def test_pytest_shard(self):
+        """Test --shard runs each test in exactly one shard"""
+        cap = []
+        tests = [f'test_ut.py::test_ut[ut_dm_{i}]' for i in (1, 10, 11, 12)]
+        tests += ['tests/test_fs.py::TestFs::test_ext4',
+                  'tests/test_fs.py::TestFs::test_ext4l']
+        os.makedirs('test/py/tests')
+        tools.write_file('test/py/tests/test_fs.py', b'# test')
+
+        def mock_pipe(pipe_list):
+            cap.append(pipe_list[0])
+            return command.CommandResult(stdout='\n'.join(tests),
+                                         return_code=0)
+
+        def mock_subprocess_run(cmd, **_kwargs):
+            cap.append(cmd)
+            return subprocess.CompletedProcess(cmd, 0)
+
+        command.TEST_RESULT = mock_pipe
+        selected = []
+        for index in range(3):
+            cap.clear()
+            args = make_args(cmd='pytest', board='sandbox',
+                             shard=f'{index}/3', test_spec=['TestFs:test'])
+            with mock.patch('subprocess.run', mock_subprocess_run):
+                with terminal.capture():
+                    res = control.run_command(args)
+            self.assertEqual(0, res)
+
+            # The spec is converted for -k when collecting
+            collect = cap[0]
+            self.assertEqual('TestFs and test',
+                             collect[collect.index('-k') + 1])
+
+            # The tests are then named exactly, not matched with -k
+            want = [cmdpy.node_to_arg(t)
+                    for t in cmdpy.shard_tests(tests, index, 3)]
+            if want:
+                cmd = cap[-1]
+                self.assertNotIn('-k', cmd)
+                self.assertEqual(want, [arg for arg in cmd if '::' in arg])
+            selected += want
+
+        # Node IDs relative to test/py are given a path from the U-Boot tree
+        fs_tests = [f'test/py/{test}' for test in tests[4:]]
+        self.assertEqual(sorted(tests[:4] + fs_tests), sorted(selected))
+
+    def test_pytest_shard_invalid(self):
+        """Test --shard with an invalid value"""
+        args = make_args(cmd='pytest', board='sandbox', shard='2/2')
+        with terminal.capture() as (_, err):
+            res = control.run_command(args)
+        self.assertEqual(1, res)
+        self.assertEqual("Invalid shard '2/2': use I/N with I < N\n",
+                         err.getvalue())
+
     def test_pytest_list_boards(self):
         """Test listing QEMU boards"""
         def mock_buildman(**_kwargs):
@@ -2393,6 +2599,32 @@ class TestUmanControl(TestBase):  # pylint: disable=too-many-public-methods
         self.assertIn('qemu-arm', out.getvalue())
         self.assertIn('qemu-riscv64', out.getvalue())
 
+    def test_pytest_list_boards_cached(self):
+        """Test the board list is cached until the U-Boot tree changes"""
+        calls = []
+
+        def mock_buildman(**_kwargs):
+            calls.append(1)
+            return command.CommandResult(
+                stdout='qemu : 1 boards\n   qemu-arm\n', return_code=0)
+
+        command.TEST_RESULT = mock_buildman
+        with mock.patch.dict(os.environ, {'HOME': self.empty_dir}):
+            with mock.patch.object(cmdpy, 'get_boards_key',
+                                   return_value='key1'):
+                self.assertEqual(['qemu-arm'],
+                                 cmdpy.list_boards_by_pattern('qemu', True))
+                self.assertEqual(['qemu-arm'],
+                                 cmdpy.list_boards_by_pattern('qemu', True))
+            self.assertEqual(1, len(calls))
+
+            # A different key or disabling the cache runs buildman again
+            with mock.patch.object(cmdpy, 'get_boards_key',
+                                   return_value='key2'):
+                cmdpy.list_boards_by_pattern('qemu', True)
+                cmdpy.list_boards_by_pattern('qemu', False)
+            self.assertEqual(3, len(calls))
+
     def test_get_uboot_dir_current(self):
         """Test get_uboot_dir finds U-Boot in current directory"""
         # setUp already created fake U-Boot tree in self.test_dir
@@ -2404,6 +2636,18 @@ class TestUmanControl(TestBase):  # pylint: disable=too-many-public-methods
         os.environ['USRC'] = self.test_dir
         self.assertEqual(self.test_dir, util.get_uboot_dir())
 
+    def test_get_uboot_dir_cached(self):
+        """Test get_uboot_dir only checks the filesystem once"""
+        with mock.patch.object(os.path, 'exists',
+                               wraps=os.path.exists) as mock_exists:
+            self.assertEqual(self.test_dir, util.get_uboot_dir())
+            self.assertEqual(self.test_dir, util.get_uboot_dir())
+        self.assertEqual(1, mock_exists.call_count)
+
+        # A different directory is looked up separately
+        os.chdir(self.empty_dir)
+        self.assertIsNone(util.get_uboot_dir())
+
     def test_get_uboot_dir_not_found(self):
         """Test get_uboot_dir returns None when no U-Boot tree found"""
         os.chdir(self.empty_dir)
@@ -2464,6 +2708,32 @@ qemu_kernel_args="-bios ${OPENSBI} -kernel ${U_BOOT_BUILD_DIR}/u-boot.bin"
         self.assertEqual('-m 1G -nographic', config['qemu_extra_args'])
         self.assertIn('${OPENSBI}', config['qemu_kernel_args'])
 
+    def test_parse_hook_config_cached(self):
+        """Test a hook config file is only parsed again when it changes"""
+        config_path = os.path.join(self.test_dir, 'conf.test')
+        tools.write_file(config_path, b'console_impl=qemu\n')
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            config = cmdpy.parse_hook_config(config_path)
+            config['console_impl'] = 'changed'
+            config = cmdpy.parse_hook_config(config_path)
+            self.assertEqual('qemu', config['console_impl'])
+        self.assertEqual(1, mock_open.call_count)
+
+        tools.write_file(config_path, b'console_impl=sandbox\n')
+        stat = os.stat(config_path)
+        os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertEqual('sandbox',
+                         cmdpy.parse_hook_config(config_path)['console_impl'])
+
+    def test_path_exists_cached(self):
+        """Test path_exists only checks each path once"""
+        with mock.patch.object(os.path, 'exists',
+                               return_value=True) as mock_exists:
+            self.assertTrue(cmdpy.path_exists('/hooks'))
+            self.assertTrue(cmdpy.path_exists('/hooks'))
+            self.assertTrue(cmdpy.path_exists('/hooks/bin'))
+        self.assertEqual(2, mock_exists.call_count)
+
     def test_parse_hook_config_nonexistent(self):
         """Test parsing non-existent config file returns empty dict"""
         config = cmdpy.parse_hook_config('/nonexistent/path')
@@ -2489,6 +2759,9 @@ qemu_kernel_args="-bios ${OPENSBI} -kernel ${U_BOOT_BUILD_DIR}/u-boot.bin"
         result = cmdpy.expand_vars('${UNKNOWN}', env)
         self.assertEqual('${UNKNOWN}', result)
 
+        # Test a value without references, including a lone $
+        self.assertEqual('-m 1G $HOME', cmdpy.expand_vars('-m 1G $HOME', env))
+
     @mock.patch('uman_pkg.cmdpy.settings')
     @mock.patch('uman_pkg.cmdpy.socket')
     def test_get_qemu_command(self, mock_socket, mock_settings):
@@ -3131,6 +3404,17 @@ int main(void) { return 0; }
         tools.write_file(src_file, self.TEST_ELF_SOURCE.encode())
         command.run('gcc', '-o', self.test_elf, src_file)
 
+        # Keep the symbol cache out of the real home directory
+        self.orig_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.test_dir
+
+    def tearDown(self):
+        if self.orig_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self.orig_home
+        super().tearDown()
+
     def test_test_subcommand_parsing(self):
         """Test that test subcommand is parsed correctly"""
         parser = cmdline.setup_parser()
@@ -3212,6 +3496,82 @@ int main(void) { return 0; }
         tests = cmdtest.get_tests_from_nm(self.test_elf, suite='env')
         self.assertEqual([('env', 'test_env_basic')], tests)
 
+    def build_flags_elf(self):
+        """Build an executable with two dm tests in the linker list
+
+        Returns:
+            str: Path to the executable
+        """
+        src = '''
+struct unit_test { const char *file, *name; int (*func)(void); int flags; };
+static int func(void) { return 0; }
+const struct unit_test _u_boot_list_2_ut_dm_2_test_acpi
+        __attribute__((used)) = { __FILE__, "acpi", func, 0x80 };
+const struct unit_test _u_boot_list_2_ut_dm_2_test_gpio
+        __attribute__((used)) = { __FILE__, "gpio", func, 0x18 };
+int main(void) { return 0; }
+'''
+        elf = os.path.join(self.test_dir, 'flags_elf')
+        src_file = os.path.join(self.test_dir, 'flags.c')
+        tools.write_file(src_file, src.encode())
+        command.run('gcc', '-o', elf, src_file)
+        return elf
+
+    def test_get_test_flags(self):
+        """Test reading test flags from the unit_test linker list"""
+        elf = self.build_flags_elf()
+        with mock.patch.object(cmdtest, 'ELFTOOLS_AVAILABLE', False):
+            self.assertEqual([('test_acpi', 0x80), ('test_gpio', 0x18)],
+                             cmdtest.get_test_flags(elf, 'dm'))
+            self.assertEqual([], cmdtest.get_test_flags(elf, 'env'))
+
+    @unittest.skipUnless(cmdtest.ELFTOOLS_AVAILABLE, 'pyelftools not installed')
+    def test_get_test_flags_elf(self):
+        """Test reading test flags with pyelftools, once per executable"""
+        elf = self.build_flags_elf()
+        with mock.patch.object(cmdtest, 'ELFFile',
+                               wraps=cmdtest.ELFFile) as mock_elf:
+            self.assertEqual([('test_acpi', 0x80), ('test_gpio', 0x18)],
+                             cmdtest.get_test_flags(elf, 'dm'))
+            self.assertEqual([], cmdtest.get_test_flags(elf, 'env'))
+            self.assertEqual([('test_acpi', 0x80), ('test_gpio', 0x18)],
+                             cmdtest.get_test_flags(elf, 'dm'))
+
+        # One read for the symbols and one for the section
+        self.assertEqual(2, mock_elf.call_count)
+
+    def test_symbol_index_on_disk(self):
+        """Test that the symbol index is reused by a later run"""
+        self.assertEqual(['dm', 'env'],
+                         cmdtest.get_suites_from_nm(self.test_elf))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.test_dir, '.cache/uman/symbols.json')))
+
+        # Drop the in-memory caches, as for a new run
+        cmdtest.run_nm.cache_clear()
+        cmdtest.read_symbols.cache_clear()
+        cmdtest.read_index.cache_clear()
+        with mock.patch.object(command, 'run_one') as mock_run:
+            self.assertEqual([('dm', 'test_acpi'), ('dm', 'test_gpio')],
+                             cmdtest.get_tests_from_nm(self.test_elf, 'dm'))
+        mock_run.assert_not_called()
+
+    def test_nm_output_cached(self):
+        """Test that nm is only run again when the executable changes"""
+        orig = command.run_one
+        with (mock.patch.object(cmdtest, 'ELFTOOLS_AVAILABLE', False),
+              mock.patch.object(command, 'run_one',
+                                side_effect=orig) as mock_run):
+            cmdtest.get_suites_from_nm(self.test_elf)
+            cmdtest.get_tests_from_nm(self.test_elf, suite='dm')
+            self.assertEqual(1, mock_run.call_count)
+
+            stat = os.stat(self.test_elf)
+            os.utime(self.test_elf, ns=(stat.st_atime_ns,
+                                        stat.st_mtime_ns + 1000000000))
+            cmdtest.get_tests_from_nm(self.test_elf)
+            self.assertEqual(2, mock_run.call_count)
+
     def test_do_test_no_sandbox(self):
         """Test do_test fails gracefully when sandbox not found"""
         args = cmdline.parse_args(['test'])
@@ -3362,6 +3722,30 @@ int main(void) { return 0; }
         self.assertEqual(0, result)
         self.assertEqual(('/sb', '-T', '-F', '-v', '-c', 'ut -E dm'), cap[0])
 
+    def test_run_tests_verbose_live(self):
+        """Test run_tests shows verbose output as it arrives"""
+        def mock_run(*_args, output_func=None, **_kwargs):
+            output_func(None, b'U-Boot banner\r\nRunning 1 dm test\r\nRes')
+            print('--')
+            output_func(None, b'ult: PASS dm_test\r\nTests done')
+            return command.CommandResult(
+                return_code=0,
+                stdout='Running 1 dm test\nResult: PASS dm_test\n')
+
+        args = cmdline.parse_args(['test', '-V', 'dm'])
+        col = terminal.Color()
+        with mock.patch.object(command, 'run_one', mock_run):
+            with mock.patch.object(cmdtest, 'ensure_dm_init_files',
+                                   return_value=True):
+                with terminal.capture() as (out, err):
+                    result = cmdtest.run_tests('/sb', [('dm', None)], args, col)
+        self.assertEqual(0, result)
+        self.assertFalse(err.getvalue())
+        lines = out.getvalue().splitlines()
+        self.assertEqual(['Running 1 dm test', '--', 'Result: PASS dm_test',
+                          'Tests done'], lines[:4])
+        self.assertIn('1 passed', lines[4])
+
     def test_parse_legacy_results_all_pass(self):
         """Test parse_legacy_results with all passing tests"""
         output = '''
@@ -3415,6 +3799,32 @@ Result: SKIP dm_test_fourth
         self.assertEqual(0, res.failed)
         self.assertEqual(1, res.skipped)
 
+    def test_parse_results_line_bounds(self):
+        """Test that results are only matched within a single line"""
+        output = 'Result:\nPASS dm_test_one\nmy Result: PASS dm_test_two\n'
+        self.assertIsNone(cmdtest.parse_results(output))
+
+        output = 'Test: dm_test_first\n... ok\nsetup ... Skipped\n'
+        res = cmdtest.parse_legacy_results(output)
+        self.assertEqual(cmdtest.TestCounts(1, 0, 1), res)
+
+    def test_parse_legacy_results_once_per_line(self):
+        """Test that each legacy line is counted once, by its best status"""
+        output = ('Test: dm_test_first ... ok ... ok\n'
+                  'Test: dm_test_second ... ok (retry) ... FAILED\r\n'
+                  'Test: dm_test_third ... ok (12ms)\r\n'
+                  'Test: dm_test_fourth ... SKIPPED ... failed\n'
+                  'Test: dm_test_fifth ... Skipped')
+        col = terminal.Color(terminal.COLOR_NEVER)
+        with terminal.capture() as (out, err):
+            res = cmdtest.parse_legacy_results(output, show_results=True,
+                                               col=col)
+        self.assertEqual(cmdtest.TestCounts(3, 1, 1), res)
+        self.assertEqual('  PASS: dm_test_first\n  PASS: dm_test_second\n'
+                         '  PASS: dm_test_third\n  FAIL: dm_test_fourth\n'
+                         '  SKIP: dm_test_fifth\n', out.getvalue())
+        self.assertEqual('', err.getvalue())
+
     def test_parse_results_empty(self):
         """Test parse_results with empty output returns None"""
         self.assertIsNone(cmdtest.parse_results(''))
@@ -3448,6 +3858,30 @@ Test: dm_test_third ... SKIPPED
         self.assertIn('FAIL: dm_test_second', stdout)
         self.assertIn('SKIP: dm_test_third', stdout)
 
+    def test_output_filter_crlf(self):
+        """Test OutputFilter with the CRLF line endings of a PTY"""
+        live = cmdtest.OutputFilter()
+        with terminal.capture() as (out, err):
+            self.assertFalse(live(None, b'U-Boot 2025.01\r\n\r\nRunn'))
+            self.assertFalse(live(None, b'ing 2 tests\r'))
+            self.assertFalse(live(None, b'\nResult: PASS dm_test_one\r\n'))
+            self.assertFalse(live(None, b'Result: FAIL dm_test_two\r'))
+            live.flush()
+        self.assertEqual('Running 2 tests\nResult: PASS dm_test_one\n'
+                         'Result: FAIL dm_test_two\n', out.getvalue())
+        self.assertEqual('', err.getvalue())
+
+    def test_parse_results_crlf(self):
+        """Test parsing output with the CRLF line endings of a PTY"""
+        output = 'Running 2 tests\r\nResult: PASS dm_test_one\r\n'
+        output += 'Result: FAIL: dm_test_two\r\n'
+        with terminal.capture() as (out, err):
+            res = cmdtest.parse_results(output, show_results=True,
+                                        col=terminal.Color())
+        self.assertEqual(cmdtest.TestCounts(1, 1, 0), res)
+        self.assertNotIn('\r', out.getvalue())
+        self.assertEqual('', err.getvalue())
+
     def test_format_duration_seconds(self):
         """Test format_duration with seconds only"""
         self.assertEqual('0.00s', util.format_duration(0))
@@ -3505,8 +3939,24 @@ Tests run: 1, failures: 1
                                                [('pxe', None)], args, col)
         self.assertEqual(1, result)
         self.assertIn('No results detected', err.getvalue())
-        # Error message should be shown in output
-        self.assertIn('Missing required argument', out.getvalue())
+        # Error message should be shown in output, without the banner
+        self.assertEqual("Missing required argument 'fs_image' for test "
+                         "'pxe_test_sysboot'\nTests run: 1, failures: 1\n",
+                         out.getvalue())
+
+    def test_do_test_unmatched(self):
+        """Test do_test reports each spec which matches no tests"""
+        args = cmdline.parse_args(['test', 'bad', 'dm.nothere', 'test_none',
+                                   'env.basic'])
+        with mock.patch.object(cmdtest, 'get_sandbox_path',
+                               return_value=self.test_elf):
+            with terminal.capture() as (out, err):
+                result = cmdtest.do_test(args)
+        self.assertEqual(1, result)
+        self.assertFalse(out.getvalue())
+        self.assertEqual('No tests found in suite: bad\n'
+                         'No tests found matching: dm.nothere\n'
+                         'No tests found matching: none\n', err.getvalue())
 
     def test_do_test_runs_tests(self):
         """Test do_test runs tests when no list flags"""
@@ -3520,7 +3970,8 @@ Tests run: 1, failures: 1
         args = cmdline.parse_args(['test', 'dm'])
         args.col = terminal.Color()
         with mock.patch.object(cmdtest, 'get_sandbox_path', return_value='/sb'):
-            with mock.patch.object(cmdtest, 'validate_specs', return_value=[]):
+            with mock.patch.object(cmdtest, 'check_specs',
+                                   return_value=([('dm', None)], [])):
                 with mock.patch.object(cmdtest, 'ensure_dm_init_files',
                                        return_value=True):
                     with mock.patch.object(command, 'run_one', mock_run):
@@ -3574,86 +4025,107 @@ Tests run: 1, failures: 1
         self.assertEqual([('dm', None), ('env', None)],
                          cmdtest.parse_test_specs(['dm', 'env']))
 
-    def test_resolve_specs_with_suite(self):
-        """Test resolve_specs passes through specs with suite"""
+    def test_check_specs_with_suite(self):
+        """Test check_specs passes through specs with suite"""
+        all_tests = [('dm', 'test_acpi'), ('env', 'test_env_basic')]
         specs = [('dm', None), ('env', 'basic')]
-        resolved, unmatched = cmdtest.resolve_specs('/path/to/sandbox', specs)
+
+        with mock.patch.object(cmdtest, 'get_tests_from_nm',
+                               return_value=all_tests):
+            resolved, unmatched = cmdtest.check_specs('/path/to/sandbox',
+                                                      specs)
         self.assertEqual(specs, resolved)
         self.assertEqual([], unmatched)
 
-    def test_resolve_specs_finds_suite(self):
-        """Test resolve_specs finds suite for pattern-only spec"""
+    def test_check_specs_finds_suite(self):
+        """Test check_specs finds suite for pattern-only spec"""
         all_tests = [('dm', 'test_acpi'), ('dm', 'test_gpio'),
                      ('env', 'test_env_basic')]
 
         with mock.patch.object(cmdtest, 'get_tests_from_nm',
                                return_value=all_tests):
-            resolved, unmatched = cmdtest.resolve_specs(
+            resolved, unmatched = cmdtest.check_specs(
                 '/path/to/sandbox', [(None, 'acpi')])
 
         self.assertEqual([('dm', 'acpi')], resolved)
         self.assertEqual([], unmatched)
 
-    def test_resolve_specs_unmatched(self):
-        """Test resolve_specs returns unmatched for unknown pattern"""
+    def test_check_specs_suffix(self):
+        """Test check_specs picks the first suite whose test matches"""
+        all_tests = [('bootstd', 'test_bootflow_scan'), ('dm', 'test_acpi'),
+                     ('dm', 'test_scan'), ('env', 'test_env_basic')]
+
+        with mock.patch.object(cmdtest, 'get_tests_from_nm',
+                               return_value=all_tests):
+            resolved, unmatched = cmdtest.check_specs(
+                '/path/to/sandbox', [(None, 'scan'), (None, 'env_basic'),
+                                     (None, 'acpix')])
+
+        self.assertEqual([('bootstd', 'scan'), ('env', 'env_basic')], resolved)
+        self.assertEqual([(None, 'acpix')], unmatched)
+
+    def test_check_specs_unmatched(self):
+        """Test check_specs returns unmatched for unknown pattern"""
         all_tests = [('dm', 'test_acpi')]
 
         with mock.patch.object(cmdtest, 'get_tests_from_nm',
                                return_value=all_tests):
-            resolved, unmatched = cmdtest.resolve_specs(
+            resolved, unmatched = cmdtest.check_specs(
                 '/path/to/sandbox', [(None, 'nonexistent')])
 
         self.assertEqual([], resolved)
         self.assertEqual([(None, 'nonexistent')], unmatched)
 
-    def test_validate_specs_all(self):
-        """Test validate_specs accepts 'all' without checking"""
-        result = cmdtest.validate_specs('/path/to/sandbox', [('all', None)])
-        self.assertEqual([], result)
+    def test_check_specs_all(self):
+        """Test check_specs accepts 'all' without checking"""
+        resolved, unmatched = cmdtest.check_specs('/path/to/sandbox',
+                                                  [('all', None)])
+        self.assertEqual([('all', None)], resolved)
+        self.assertEqual([], unmatched)
 
-    def test_validate_specs_valid_suite(self):
-        """Test validate_specs accepts valid suite"""
+    def test_check_specs_valid_suite(self):
+        """Test check_specs accepts valid suite"""
         all_tests = [('dm', 'test_acpi'), ('dm', 'test_gpio')]
 
         with mock.patch.object(cmdtest, 'get_tests_from_nm',
                                return_value=all_tests):
-            result = cmdtest.validate_specs('/path/to/sandbox',
-                                            [('dm', None)])
+            _, unmatched = cmdtest.check_specs('/path/to/sandbox',
+                                               [('dm', None)])
 
-        self.assertEqual([], result)
+        self.assertEqual([], unmatched)
 
-    def test_validate_specs_valid_pattern(self):
-        """Test validate_specs accepts valid suite with pattern"""
+    def test_check_specs_valid_pattern(self):
+        """Test check_specs accepts valid suite with pattern"""
         all_tests = [('dm', 'test_acpi'), ('dm', 'test_gpio')]
 
         with mock.patch.object(cmdtest, 'get_tests_from_nm',
                                return_value=all_tests):
-            result = cmdtest.validate_specs('/path/to/sandbox',
-                                            [('dm', 'acpi')])
+            _, unmatched = cmdtest.check_specs('/path/to/sandbox',
+                                               [('dm', 'acpi')])
 
-        self.assertEqual([], result)
+        self.assertEqual([], unmatched)
 
-    def test_validate_specs_invalid_suite(self):
-        """Test validate_specs returns unmatched for invalid suite"""
+    def test_check_specs_invalid_suite(self):
+        """Test check_specs returns unmatched for invalid suite"""
         all_tests = [('dm', 'test_acpi')]
 
         with mock.patch.object(cmdtest, 'get_tests_from_nm',
                                return_value=all_tests):
-            result = cmdtest.validate_specs('/path/to/sandbox',
-                                            [('nonexistent', None)])
+            _, unmatched = cmdtest.check_specs('/path/to/sandbox',
+                                               [('nonexistent', None)])
 
-        self.assertEqual([('nonexistent', None)], result)
+        self.assertEqual([('nonexistent', None)], unmatched)
 
-    def test_validate_specs_invalid_pattern(self):
-        """Test validate_specs returns unmatched for invalid pattern"""
+    def test_check_specs_invalid_pattern(self):
+        """Test check_specs returns unmatched for invalid pattern"""
         all_tests = [('dm', 'test_acpi')]
 
         with mock.patch.object(cmdtest, 'get_tests_from_nm',
                                return_value=all_tests):
-            result = cmdtest.validate_specs('/path/to/sandbox',
-                                            [('dm', 'nonexistent')])
+            _, unmatched = cmdtest.check_specs('/path/to/sandbox',
+                                               [('dm', 'nonexistent')])
 
-        self.assertEqual([('dm', 'nonexistent')], result)
+        self.assertEqual([('dm', 'nonexistent')], unmatched)
 
     def test_get_section_info(self):
         """Test parsing readelf output for section info"""
@@ -3782,6 +4254,25 @@ class TestPytestCTest(TestBase):
         self.assertIsNone(cls)
         self.assertIsNone(method)
 
+        # The tree is only scanned once
+        with mock.patch.object(os, 'walk') as mock_walk:
+            path, _, _ = cmdpy.find_test(self.test_dir, 'ext4l')
+        self.assertEqual(test_file, path)
+        mock_walk.assert_not_called()
+
+        # Files directly in test/py are found too, but not caches
+        cmdpy.get_test_files.cache_clear()
+        top_file = os.path.join(self.test_dir, 'test/py/test_top.py')
+        tools.write_file(top_file, b'# test file')
+        cache_dir = os.path.join(self.test_dir, 'test/py/__pycache__')
+        os.makedirs(cache_dir)
+        tools.write_file(os.path.join(cache_dir, 'test_cached.py'), b'')
+        self.assertIsNone(cmdpy.find_test(self.test_dir, 'cached')[0])
+        path, cls, method = cmdpy.find_test(self.test_dir, 'top')
+        self.assertEqual(top_file, path)
+        self.assertEqual('TestTop', cls)
+        self.assertIsNone(method)
+
     def test_find_test_camel_case(self):
         """Test finding test file with CamelCase class name"""
         # Create test file with snake_case name
@@ -3790,9 +4281,12 @@ class TestPytestCTest(TestBase):
         test_file = os.path.join(test_dir, 'test_pxe_parser.py')
         tools.write_file(test_file, b'# test file')
 
-        # Test CamelCase class name maps to snake_case file
-        path, cls, method = cmdpy.find_test(self.test_dir,
-                                            'TestPxeParser:test_pxe_ipappend')
+        # Test CamelCase class name maps to snake_case file, found without
+        # scanning the tree
+        with mock.patch.object(os, 'walk') as mock_walk:
+            path, cls, method = cmdpy.find_test(
+                self.test_dir, 'TestPxeParser:test_pxe_ipappend')
+        mock_walk.assert_not_called()
         self.assertEqual(test_file, path)
         self.assertEqual('TestPxeParser', cls)
         self.assertEqual('test_pxe_ipappend', method)
@@ -3824,6 +4318,14 @@ def ext4_image(self, u_boot_config):
                          paths['fs_image'])
         self.assertIsNone(reason)
 
+        # Source which has already been read is not read again
+        with mock.patch.object(settings, 'get', return_value='/tmp/b'):
+            paths, _ = cmdpy.get_fixture_paths(
+                '/nonexistent/test_ext4l.py', kwargs, fixtures,
+                test_content.decode())
+        self.assertEqual('/tmp/b/sandbox/persistent-data/ext4l_test.img',
+                         paths['fs_image'])
+
     def test_get_fixture_paths_fshelper(self):
         """Test get_fixture_paths handles FsHelper pattern"""
         test_content = b'''
@@ -3992,7 +4494,7 @@ class TestExt4l:
 
         # Test with PASS result - no output shown
         mock_exec.return_value = command.CommandResult(
-            return_code=0, stdout='Result: PASS: test\nTest output\n')
+            return_code=0, stdout=b'Result: PASS: test\nTest output\n')
 
         args = argparse.Namespace(test_spec=['TestExt4l:test_unlink'],
                                   dry_run=False, show_cmd=False,
@@ -4007,7 +4509,7 @@ class TestExt4l:
 
         # Test with FAIL result - output shown
         mock_exec.return_value = command.CommandResult(
-            return_code=1, stdout='Result: FAIL: test\nTest output\n')
+            return_code=1, stdout=b'Result: FAIL: test\nTest output\xff\n')
 
         with terminal.capture() as (out, _err):
             ret = cmdpy.run_c_test(args)
@@ -4016,14 +4518,58 @@ class TestExt4l:
         self.assertIn('1 failed', output)
         self.assertIn('Test output', output)
 
+    @mock.patch.object(cmdpy, 'get_uboot_dir')
+    @mock.patch.object(cmdpy, 'get_sandbox_path')
+    @mock.patch.object(cmdpy, 'get_fixture_paths')
+    @mock.patch.object(cmdpy, 'exec_cmd')
+    def test_run_c_test_quotes_paths(self, mock_exec, mock_fixture,
+                                     mock_sandbox, mock_uboot_dir):
+        """Test run_c_test quotes fixture paths containing spaces"""
+        mock_uboot_dir.return_value = self.test_dir
+        mock_sandbox.return_value = '/path/to/sandbox'
+
+        test_fs_dir = os.path.join(self.test_dir, 'test/py/tests/test_fs')
+        os.makedirs(test_fs_dir)
+        test_file = os.path.join(test_fs_dir, 'test_ext4l.py')
+        test_content = '''
+class TestExt4l:
+    def test_unlink(self):
+        ubman.run_ut('ext4l', 'fs_test_ext4l_unlink', fs_image=ext4_image)
+'''
+        tools.write_file(test_file, test_content.encode())
+
+        fixture_path = os.path.join(self.test_dir, 'my img.img')
+        tools.write_file(fixture_path, b'')
+        mock_fixture.return_value = ({'fs_image': fixture_path}, None)
+        mock_exec.return_value = command.CommandResult(
+            return_code=0, stdout=b'Result: PASS: test\n')
+
+        args = argparse.Namespace(test_spec=['TestExt4l:test_unlink'],
+                                  dry_run=False, show_cmd=False,
+                                  show_output=False, build=False, lto=False)
+        with terminal.capture():
+            cmdpy.run_c_test(args)
 
-class TestPytestPollute(TestBase):
+        self.assertEqual(
+            ['/path/to/sandbox', '-T', '-F', '-c',
+             f"ut -Em ext4l fs_test_ext4l_unlink_norun "
+             f"fs_image='{fixture_path}'"],
+            mock_exec.call_args[0][0])
+
+
+class TestPytestPollute(TestBase):  # pylint: disable=too-many-public-methods
     """Tests for the pytest --pollute functionality"""
 
     def setUp(self):
         tout.init(tout.WARNING)
         self.test_dir = None
 
+    @staticmethod
+    def make_search(args=None, cache=None):
+        """Create a search for 'test_target' with an empty environment"""
+        return pollute.Search('test_target', args or make_args(board='sandbox'),
+                              {}, cache or pollute.PolluteCache(None))
+
     def test_pollute_flag_parsing(self):
         """Test --pollute flag is parsed correctly"""
         args = cmdline.parse_args(['pytest', '-B', 'sandbox',
@@ -4031,6 +4577,23 @@ class TestPytestPollute(TestBase):
         self.assertEqual('test_foo', args.pollute)
         self.assertEqual('sandbox', args.board)
 
+    def test_pollute_options_positive(self):
+        """Test --pollute-jobs and --pollute-timeout must be positive"""
+        args = cmdline.parse_args(['pytest', '--pollute-jobs', '4',
+                                   '--pollute-timeout', '2.5'])
+        self.assertEqual(4, args.pollute_jobs)
+        self.assertEqual(2.5, args.pollute_timeout)
+
+        for opt, val in (('--pollute-jobs', '0'), ('--pollute-jobs', '-2'),
+                         ('--pollute-jobs', 'x'), ('--pollute-timeout', '0'),
+                         ('--pollute-timeout', '-1')):
+            with self.assertRaises(SystemExit):
+                with terminal.capture() as (out, err):
+                    cmdline.parse_args(['pytest', opt, val])
+            self.assertEqual('', out.getvalue())
+            self.assertIn(f"{opt}: invalid positive", err.getvalue())
+            self.assertIn(f"value: '{val}'", err.getvalue())
+
     def test_collect_tests_parsing(self):
         """Test parsing of --collect-only output"""
         collect_output = '''test_ut.py::TestUt::test_dm
@@ -4052,25 +4615,23 @@ test_fs.py::TestFs::test_ext4
         self.assertEqual('test_ut.py::TestUt::test_env', tests[1])
         self.assertEqual('test_fs.py::TestFs::test_ext4', tests[2])
 
-    def test_pollute_run_uses_k_with_names(self):
-        """Test pollute_run uses -k with extracted test names"""
+    def test_search_run_pytest_uses_k_with_names(self):
+        """Test Search.run_pytest() uses -k with extracted test names"""
         captured_cmd = []
 
         def mock_popen(cmd, **_kwargs):
             captured_cmd.extend(cmd)
             proc = mock.Mock()
-            proc.stdout.read.return_value = b''  # pylint: disable=no-member
+            proc.stdout.read1.return_value = b''  # pylint: disable=no-member
             proc.returncode = 0
             return proc
 
         with mock.patch('subprocess.Popen', mock_popen):
-            args = argparse.Namespace(board='sandbox', build_dir=None,
-                                      lto=False, full=False)
-            env = {}
             tests = ['tests/test_ut.py::test_ut[ut_dm_foo]',
                      'tests/test_ut.py::test_ut[ut_dm_bar]']
             target = 'tests/test_ut.py::test_ut[ut_dm_target]'
-            cmdpy.pollute_run(tests, target, args, env)
+            pollute.Search(target, make_args(board='sandbox'), {},
+                           pollute.PolluteCache(None)).run_pytest(tests)
 
         # Uses -k with extracted test names
         self.assertIn('-k', captured_cmd)
@@ -4089,22 +4650,20 @@ test_fs.py::TestFs::test_ext4
         # Simple name
         self.assertEqual('test_simple', cmdpy.node_to_name('test_simple'))
 
-    def test_pollute_run_uses_pollute_build_dir(self):
-        """Test pollute_run uses -pollute suffix for build dir"""
+    def test_search_run_pytest_uses_pollute_build_dir(self):
+        """Test Search.run_pytest() uses -pollute suffix for build dir"""
         captured_cmd = []
 
         def mock_popen(cmd, **_kwargs):
             captured_cmd.extend(cmd)
             proc = mock.Mock()
-            proc.stdout.read.return_value = b''  # pylint: disable=no-member
+            proc.stdout.read1.return_value = b''  # pylint: disable=no-member
             proc.returncode = 0
             return proc
 
         with mock.patch('subprocess.Popen', mock_popen):
             with mock.patch.object(settings, 'get', return_value='/tmp/b'):
-                args = argparse.Namespace(board='sandbox', build_dir=None,
-                                          lto=False, full=False)
-                cmdpy.pollute_run([], 'test_target', args, {})
+                self.make_search().run_pytest([])
 
         self.assertIn('--build-dir', captured_cmd)
         idx = captured_cmd.index('--build-dir')
@@ -4149,42 +4708,417 @@ test_fs.py::TestFs::test_ext4
         self.assertIn('--no-full', err.getvalue())
         self.assertIn('use -f', err.getvalue())
 
-    def test_pollute_run_no_full_flag(self):
-        """Test pollute_run adds --no-full when full=False"""
+    def test_search_run_pytest_no_full_flag(self):
+        """Test Search.run_pytest() adds --no-full when full=False"""
         captured_cmd = []
 
         def mock_popen(cmd, **_kwargs):
             captured_cmd.extend(cmd)
             proc = mock.Mock()
-            proc.stdout.read.return_value = b''  # pylint: disable=no-member
+            proc.stdout.read1.return_value = b''  # pylint: disable=no-member
             proc.returncode = 0
             return proc
 
         with mock.patch('subprocess.Popen', mock_popen):
-            args = argparse.Namespace(board='sandbox', build_dir=None,
-                                      lto=False, full=False)
-            cmdpy.pollute_run([], 'test_target', args, {})
+            self.make_search().run_pytest([])
 
         self.assertIn('--no-full', captured_cmd)
 
-    def test_pollute_run_full_flag(self):
-        """Test pollute_run omits --no-full when full=True"""
+    def test_search_run_pytest_full_flag(self):
+        """Test Search.run_pytest() omits --no-full when full=True"""
         captured_cmd = []
 
         def mock_popen(cmd, **_kwargs):
             captured_cmd.extend(cmd)
             proc = mock.Mock()
-            proc.stdout.read.return_value = b''  # pylint: disable=no-member
+            proc.stdout.read1.return_value = b''  # pylint: disable=no-member
             proc.returncode = 0
             return proc
 
         with mock.patch('subprocess.Popen', mock_popen):
-            args = argparse.Namespace(board='sandbox', build_dir=None,
-                                      lto=False, full=True)
-            cmdpy.pollute_run([], 'test_target', args, {})
+            args = make_args(board='sandbox', full=True)
+            self.make_search(args).run_pytest([])
 
         self.assertNotIn('--no-full', captured_cmd)
 
+    def test_search_run_pytest_no_xdist(self):
+        """Test Search.run_pytest() keeps the tests in one process"""
+        captured_cmd = []
+
+        def mock_popen(cmd, **_kwargs):
+            captured_cmd.extend(cmd)
+            proc = mock.Mock()
+            proc.stdout.read1.return_value = b''  # pylint: disable=no-member
+            proc.returncode = 0
+            return proc
+
+        with mock.patch('subprocess.Popen', mock_popen):
+            self.make_search().run_pytest(['test_a'])
+
+        idx = captured_cmd.index('no:xdist')
+        self.assertEqual('-p', captured_cmd[idx - 1])
+
+        # Stops at the first failure, without reordering
+        self.assertIn('-x', captured_cmd)
+        self.assertNotIn('--ff', captured_cmd)
+
+    def test_search_run_pytest_slot(self):
+        """Test Search.run_pytest() gives each slot its own directories"""
+        captured_cmd = []
+
+        def mock_popen(cmd, **_kwargs):
+            captured_cmd.extend(cmd)
+            proc = mock.Mock()
+            proc.stdout.read1.return_value = b''  # pylint: disable=no-member
+            proc.returncode = 0
+            return proc
+
+        with mock.patch('subprocess.Popen', mock_popen):
+            with mock.patch.object(settings, 'get', return_value='/tmp/b'):
+                self.make_search().run_pytest([], slot=2)
+
+        idx = captured_cmd.index('--result-dir')
+        self.assertEqual('/tmp/b/sandbox-pollute/slot2', captured_cmd[idx + 1])
+        idx = captured_cmd.index('--persistent-data-dir')
+        self.assertEqual('/tmp/b/sandbox-pollute/slot2/persistent-data',
+                         captured_cmd[idx + 1])
+
+    def test_search_bisect(self):
+        """Test Search.bisect() halves the candidates at each step"""
+        runs = []
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del cancel
+            runs.append((slot, tests))
+            return 'test_6' in tests
+
+        candidates = [f'test_{i}' for i in range(10)]
+        with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+            with terminal.capture() as (out, _):
+                result = self.make_search().bisect(candidates)
+        self.assertEqual(['test_6'], result)
+
+        # Each run is a disjoint part of the candidates, with no slot
+        self.assertEqual([(None, candidates[:5]), (None, candidates[5:8]),
+                          (None, candidates[5:7]), (None, candidates[5:6])],
+                         runs)
+        self.assertEqual('  Step 1/4: 5 tests...\n'
+                         '  Step 2/4: 3 tests...\n'
+                         '  Step 3/4: 2 tests...\n'
+                         '  Step 4/4: 1 tests...\n', out.getvalue())
+
+    def test_count_steps(self):
+        """Test count_steps works out the number of bisection steps"""
+        for count, steps in ((0, 0), (1, 0), (2, 1), (3, 2), (4, 2), (5, 3),
+                             (1024, 10), (1025, 11)):
+            self.assertEqual(steps, pollute.count_steps(count, 2))
+        for count, steps in ((1, 0), (4, 1), (5, 2), (16, 2), (17, 3)):
+            self.assertEqual(steps, pollute.count_steps(count, 4))
+
+    def test_search_bisect_jobs(self):
+        """Test serial and parallel searches blame the same test"""
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot, cancel
+            return 'test_7' in tests
+
+        candidates = [f'test_{i}' for i in range(10)]
+        for jobs in (1, 2, 3):
+            with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+                with terminal.capture():
+                    result = self.make_search(
+                        make_args(pollute_jobs=jobs)).bisect(candidates)
+            self.assertEqual(['test_7'], result)
+
+    def test_search_bisect_parallel(self):
+        """Test Search.bisect() runs several parts at once with jobs"""
+        runs = []
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del cancel
+            runs.append((slot, tests))
+            return 'test_7' in tests
+
+        candidates = [f'test_{i}' for i in range(10)]
+        args = make_args(pollute_jobs=3)
+        with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+            with terminal.capture() as (out, _):
+                result = self.make_search(args).bisect(candidates)
+        self.assertEqual(['test_7'], result)
+
+        # First step: 4 parts of up to 3 tests, all but the last are run
+        self.assertEqual([(0, ['test_0', 'test_1', 'test_2']),
+                          (1, ['test_3', 'test_4', 'test_5']),
+                          (2, ['test_6', 'test_7', 'test_8'])],
+                         sorted(runs[:3]))
+        self.assertEqual(
+            '  Step 1/2: 3 runs of up to 3 tests...\n'
+            '  Step 2/2: 2 runs of up to 1 tests...\n', out.getvalue())
+
+    def test_search_bisect_cancel(self):
+        """Test Search.bisect() stops runs which are no longer needed"""
+        cancelled = []
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot
+            if 'test_0' in tests:
+                return True
+            cancel.wait()
+            cancelled.append(tests)
+            return None
+
+        candidates = [f'test_{i}' for i in range(4)]
+        args = make_args(pollute_jobs=3)
+        cache = pollute.PolluteCache(None)
+        with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+            with terminal.capture():
+                result = self.make_search(args, cache).bisect(candidates)
+        self.assertEqual(['test_0'], result)
+        self.assertEqual([['test_1'], ['test_2']], sorted(cancelled))
+
+        # Cancelled runs are not cached
+        self.assertTrue(cache.get(['test_0'], 'test_target'))
+        self.assertIsNone(cache.get(['test_1'], 'test_target'))
+
+    def test_search_run_parts_interrupted(self):
+        """Test Search.run_parts() stops all its runs on Ctrl+C"""
+        cancelled = []
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot
+            cancelled.append((tests, cancel.wait(5)))
+
+        parts = [['test_0'], ['test_1']]
+        with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+            with mock.patch('concurrent.futures.as_completed',
+                            side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    self.make_search().run_parts(parts)
+        self.assertEqual([(['test_0'], True), (['test_1'], True)],
+                         sorted(cancelled))
+
+    def test_search_run_pytest_cancel(self):
+        """Test Search.run_pytest() stops the run when cancelled"""
+        cancel = threading.Event()
+        cancel.set()
+        args = make_args(board='sandbox', build_dir=self.test_dir)
+        stopped = threading.Event()
+        with mock.patch.object(pollute, 'plugin_args', return_value=[]):
+            with mock.patch.object(subprocess, 'Popen') as mock_popen:
+                proc = mock_popen.return_value
+                proc.stdout.read1.return_value = b''
+                proc.poll.return_value = None
+                proc.wait.side_effect = stopped.wait
+                with mock.patch.object(pollute, 'stop_proc',
+                                       side_effect=lambda _: stopped.set()
+                                       ) as mock_stop:
+                    result = self.make_search(args).run_pytest(
+                        [], cancel=cancel)
+        self.assertIsNone(result)
+        mock_stop.assert_called_once_with(proc)
+        self.assertTrue(mock_popen.call_args.kwargs['start_new_session'])
+
+    def test_stop_proc(self):
+        """Test stop_proc stops a process which ignores SIGINT"""
+        prog = ('import signal, time; '
+                'signal.signal(signal.SIGINT, signal.SIG_IGN); '
+                'print(flush=True); time.sleep(10)')
+        # pylint: disable=consider-using-with
+        proc = subprocess.Popen([sys.executable, '-c', prog],
+                                stdout=subprocess.PIPE, start_new_session=True)
+        proc.stdout.readline()  # wait until SIGINT is ignored
+        pollute.stop_proc(proc, grace=0.2)
+        self.assertEqual(-9, proc.wait(5))
+        proc.stdout.close()
+
+    def test_search_run_args(self):
+        """Test Search.run passes on the slot and cancel event"""
+        cancel = threading.Event()
+        with mock.patch.object(pollute.Search, 'run_pytest',
+                               return_value=False) as mock_run:
+            self.make_search().run(['test_a'], 2, cancel)
+        mock_run.assert_called_once_with(['test_a'], 2, cancel)
+
+    def test_search_run_timed_out(self):
+        """Test a run which times out counts as a failure but is not cached"""
+        cache = pollute.PolluteCache(None)
+        args = make_args(board='sandbox', pollute_timeout=30.0)
+        with mock.patch.object(pollute.Search, 'run_pytest',
+                               return_value=pollute.TIMEOUT):
+            with terminal.capture() as (out, err):
+                self.assertTrue(self.make_search(args, cache).run(
+                    ['a.py::test_a', 'a.py::test_b']))
+        self.assertFalse(out.getvalue())
+        self.assertEqual('Run of 2 tests (test_a .. test_b) timed out after '
+                         '30.0s, counting it as a failure\n', err.getvalue())
+        self.assertIsNone(cache.get(['a.py::test_a', 'a.py::test_b'],
+                                    'test_target'))
+
+    def test_search_run_pytest_timeout(self):
+        """Test run_pytest stops a run which takes too long"""
+        args = make_args(board='sandbox', build_dir=self.test_dir,
+                         pollute_timeout=0.01)
+        stopped = threading.Event()
+
+        def read1(_size):
+            stopped.wait(5)
+            return b''
+
+        with mock.patch.object(pollute, 'plugin_args', return_value=[]):
+            with mock.patch.object(subprocess, 'Popen') as mock_popen:
+                proc = mock_popen.return_value
+                proc.stdout.read1.side_effect = read1
+                with mock.patch.object(pollute, 'stop_proc',
+                                       side_effect=lambda _: stopped.set()):
+                    result = self.make_search(args).run_pytest([])
+        self.assertEqual(pollute.TIMEOUT, result)
+
+    def test_search_run_pytest_interrupted(self):
+        """Test run_pytest stops its run if interrupted, e.g. by Ctrl+C"""
+        args = make_args(board='sandbox', build_dir=self.test_dir,
+                         pollute_timeout=30.0)
+        with mock.patch.object(pollute, 'plugin_args', return_value=[]):
+            with mock.patch.object(subprocess, 'Popen') as mock_popen:
+                proc = mock_popen.return_value
+                proc.stdout.read1.side_effect = KeyboardInterrupt
+                with mock.patch.object(pollute, 'stop_proc') as mock_stop:
+                    with self.assertRaises(KeyboardInterrupt):
+                        self.make_search(args).run_pytest([])
+        self.assertTrue(mock_popen.call_args.kwargs['start_new_session'])
+        mock_stop.assert_called_once_with(proc)
+
+    def test_pollute_cache(self):
+        """Test PolluteCache stores verdicts on disk once saved"""
+        self.test_dir = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {'HOME': self.test_dir}):
+            cache = pollute.PolluteCache('pollute.json', 'key1')
+            self.assertIsNone(cache.get(['test_a'], 'test_target'))
+            cache.put(['test_a'], 'test_target', True)
+            cache.put([], 'test_target', False)
+
+            # Nothing is written until the search is confirmed
+            self.assertEqual({}, pollute.PolluteCache('pollute.json',
+                                                      'key1').verdicts)
+            cache.save()
+
+            cache = pollute.PolluteCache('pollute.json', 'key1')
+            self.assertTrue(cache.get(['test_a'], 'test_target'))
+            self.assertFalse(cache.get([], 'test_target'))
+            self.assertIsNone(cache.get(['test_b'], 'test_target'))
+
+            # A different key ignores the verdicts
+            cache = pollute.PolluteCache('pollute.json', 'key2')
+            self.assertIsNone(cache.get(['test_a'], 'test_target'))
+
+    def test_search_run_cached(self):
+        """Test Search.run only runs pytest on a cache miss"""
+        search = self.make_search()
+        with mock.patch.object(pollute.Search, 'run_pytest',
+                               return_value=True) as mock_run:
+            self.assertTrue(search.run(['test_a']))
+            self.assertTrue(search.run(['test_a']))
+        self.assertEqual(1, mock_run.call_count)
+
+    def test_get_pollute_cache_disabled(self):
+        """Test --no-cache disables the pollute cache"""
+        args = make_args(board='sandbox', no_cache=True)
+        cache = pollute.get_pollute_cache(args, '/tmp/b/sandbox')
+        self.assertIsNone(cache.name)
+
+        # Verdicts are still remembered in memory
+        cache.put(['test_a'], 'test_target', True)
+        self.assertTrue(cache.get(['test_a'], 'test_target'))
+
+    def test_get_pollute_cache_dirty(self):
+        """Test uncommitted changes give a new pollute-cache key"""
+        diff = [b'']
+
+        def mock_git(*args, binary=False):
+            if args[0] == 'rev-parse':
+                return 'abc123'
+            if args[0] == 'diff':
+                self.assertTrue(binary)
+                return diff[0]
+            return ''
+
+        args = make_args(board='sandbox')
+        with mock.patch.object(pollute, 'git_output', mock_git):
+            clean = pollute.get_pollute_cache(args, '/tmp/b/sandbox')
+            diff[0] = b'+    assert 1'
+            dirty = pollute.get_pollute_cache(args, '/tmp/b/sandbox')
+        self.assertEqual('pollute-sandbox.json', clean.name)
+        self.assertNotEqual(clean.key, dirty.key)
+
+    def test_get_tree_state_not_utf8(self):
+        """Test uncommitted changes which are not UTF-8 can be hashed"""
+        self.test_dir = tempfile.mkdtemp()
+        orig_cwd = os.getcwd()
+        os.chdir(self.test_dir)
+        try:
+            tools.write_file('latin1.txt', b'caf\xe9\n')
+            for cmd in (['init', '-q'], ['add', 'latin1.txt'],
+                        ['-c', 'user.name=Test', '-c', 'user.email=t@e.st',
+                         'commit', '-q', '-m', 'Add file']):
+                command.run_one('git', *cmd, capture=True)
+            clean = pollute.get_tree_state()
+            tools.write_file('latin1.txt', b'na\xefve\n')
+            dirty = pollute.get_tree_state()
+        finally:
+            os.chdir(orig_cwd)
+        self.assertNotEqual(clean, dirty)
+
+    @mock.patch.object(pollute, 'setup_uboot_dir')
+    @mock.patch.object(pollute, 'collect_tests')
+    @mock.patch.object(pollute, 'pytest_env', return_value={})
+    def test_pollute_save_confirmed(self, _mock_env, mock_collect,
+                                    mock_uboot_dir):
+        """Test verdicts are only saved once the polluter is confirmed"""
+        mock_uboot_dir.return_value = os.getcwd()
+        mock_collect.return_value = ['test_a', 'test_b', 'test_target']
+        needs = {'test_a'}
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot, cancel
+            return needs <= set(tests)
+
+        cache = pollute.PolluteCache(None)
+        args = make_args(cmd='pytest', board='sandbox', pollute='test_target')
+        with mock.patch.object(pollute, 'get_pollute_cache',
+                               return_value=cache):
+            with mock.patch.object(cache, 'save') as mock_save:
+                with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+                    with terminal.capture():
+                        self.assertEqual(0, pollute.do_pollute(args))
+                mock_save.assert_called_once_with()
+
+                # Two tests are needed, so the final check is inconclusive
+                # and nothing is saved
+                cache.verdicts.clear()
+                mock_save.reset_mock()
+                needs.add('test_b')
+                with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+                    with terminal.capture():
+                        self.assertEqual(1, pollute.do_pollute(args))
+                mock_save.assert_not_called()
+
+    def test_search_run_pytest_progress(self):
+        """Test Search.run_pytest() counts pytest result characters"""
+        def mock_popen(_cmd, **_kwargs):
+            proc = mock.Mock()
+            data = iter([b'a.s\n', b'F', b'\n', b''])
+            # pylint: disable=no-member
+            proc.stdout.read1.side_effect = lambda _size: next(data)
+            proc.returncode = 1
+            return proc
+
+        with mock.patch('subprocess.Popen', mock_popen):
+            with mock.patch.object(tout, 'progress') as mock_progress:
+                failed = self.make_search().run_pytest(['test_a', 'test_b'])
+
+        self.assertTrue(failed)
+        self.assertEqual([mock.call('    2/3', trailer=''),
+                          mock.call('    3/3', trailer='')],
+                         mock_progress.call_args_list)
+
     def test_pollute_build_to_pollute_dir(self):
         """Test --pollute -b builds to pollute directory"""
         cap = []
@@ -4204,7 +5138,7 @@ test_fs.py::TestFs::test_ext4
         args = make_args(cmd='pytest', board='sandbox', build=True,
                          pollute='test_dm_foo')
         with mock.patch.object(build, 'setup_uboot_dir', return_value=True):
-            with mock.patch.object(cmdpy, 'exec_cmd', mock_exec_cmd):
+            with mock.patch.object(pollute, 'exec_cmd', mock_exec_cmd):
                 with terminal.capture():
                     control.run_command(args)
 
@@ -4233,8 +5167,95 @@ test_fs.py::TestFs::test_ext4
         args = make_args(cmd='pytest', board='sandbox', build=True,
                          lto=True, pollute='test_dm_foo')
         with mock.patch.object(build, 'setup_uboot_dir', return_value=True):
-            with mock.patch.object(cmdpy, 'exec_cmd', mock_exec_cmd):
+            with mock.patch.object(pollute, 'exec_cmd', mock_exec_cmd):
                 with terminal.capture():
                     control.run_command(args)
 
         self.assertNotIn('-L', cap[0])
+
+    @mock.patch.object(pollute, 'setup_uboot_dir')
+    @mock.patch.object(pollute, 'collect_tests')
+    @mock.patch.object(pollute, 'get_pollute_cache',
+                       side_effect=lambda *_: pollute.PolluteCache(None))
+    @mock.patch.object(pollute, 'pytest_env', return_value={})
+    def test_pollute_trust_target(self, _mock_env, _mock_cache, mock_collect,
+                                  mock_uboot_dir):
+        """Test --trust-target skips running the target alone"""
+        mock_uboot_dir.return_value = os.getcwd()
+        mock_collect.return_value = ['test_a', 'test_b', 'test_target']
+        runs = []
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot, cancel
+            runs.append(tests)
+            return 'test_b' in tests
+
+        for trust, first in ((False, []), (True, ['test_a', 'test_b'])):
+            runs.clear()
+            args = make_args(cmd='pytest', board='sandbox',
+                             pollute='test_target', trust_target=trust)
+            with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+                with terminal.capture():
+                    res = pollute.do_pollute(args)
+            self.assertEqual(0, res)
+            self.assertEqual(first, runs[0])
+
+    @mock.patch.object(pollute, 'setup_uboot_dir')
+    @mock.patch.object(pollute, 'collect_tests')
+    @mock.patch.object(pollute, 'pytest_env', return_value={})
+    def test_pollute_no_repeat_verify(self, _mock_env, mock_collect,
+                                      mock_uboot_dir):
+        """Test the final check reuses a run of the polluter alone"""
+        mock_uboot_dir.return_value = os.getcwd()
+        mock_collect.return_value = ['test_a', 'test_b', 'test_target']
+        runs = []
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot, cancel
+            runs.append(tests)
+            return 'test_a' in tests
+
+        args = make_args(cmd='pytest', board='sandbox', pollute='test_target',
+                         no_cache=True)
+        with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+            with terminal.capture():
+                self.assertEqual(0, pollute.do_pollute(args))
+        self.assertEqual([[], ['test_a', 'test_b'], ['test_a']], runs)
+
+    @mock.patch.object(pollute, 'setup_uboot_dir')
+    @mock.patch.object(pollute, 'collect_tests')
+    @mock.patch.object(pollute, 'get_pollute_cache',
+                       side_effect=lambda *_: pollute.PolluteCache(None))
+    @mock.patch.object(pollute, 'pytest_env', return_value={})
+    def test_pollute_found_no_color(self, _mock_env, _mock_cache,
+                                    mock_collect, mock_uboot_dir):
+        """Test the polluter is not coloured when output is not a tty"""
+        mock_uboot_dir.return_value = os.getcwd()
+        mock_collect.return_value = ['test_a', 'test_b', 'test_target']
+        tout.init(tout.NOTICE)
+
+        def mock_run(_self, tests, slot=None, cancel=None):
+            del slot, cancel
+            return 'test_b' in tests
+
+        args = make_args(cmd='pytest', board='sandbox', pollute='test_target')
+        with mock.patch.object(pollute.Search, 'run_pytest', mock_run):
+            with terminal.capture() as (out, err):
+                self.assertEqual(0, pollute.do_pollute(args))
+        self.assertEqual(
+            'Collecting tests...\n'
+            "Found 3 tests, target 'test_target' at position 3\n"
+            'Verifying target passes alone...\n'
+            '  OK\n'
+            'Verifying target fails with all prior tests...\n'
+            '  FAIL (confirmed)\n'
+            'Searching for polluter in 2 candidates...\n'
+            '  Step 1/1: 1 tests...\n'
+            '  -> PASS (polluter in second half)\n'
+            '  Verifying test_b...\n'
+            '  -> FAIL (confirmed)\n'
+            '\n'
+            'Found: test_target polluted by test_b\n'
+            '  Run: uman py -B sandbox "test_b or test_target"\n',
+            out.getvalue())
+        self.assertEqual('', err.getvalue())
@@ -0,0 +1,584 @@
+# SPDX-License-Identifier: GPL-2.0+
+# Copyright 2025 Canonical Ltd
+# Written by Simon Glass <simon.glass@canonical.com>
+
+"""Search for the test which pollutes another
+
+This module handles the --pollute option of the 'pytest' subcommand, which
+finds the earlier test that makes a target test fail.
+"""
+
+import hashlib
+import os
+import signal
+import subprocess
+import threading
+
+# pylint: disable=import-error
+from u_boot_pylib import command
+from u_boot_pylib import terminal
+from u_boot_pylib import tools
+from u_boot_pylib import tout
+
+from uman_pkg.cmdpy import (TEST_PY_DIR, collect_tests, get_build_dir,
+                            node_to_name, path_exists, plugin_args, pytest_env,
+                            setup_board)
+from uman_pkg.util import (exec_cmd, git_output, read_cache, setup_uboot_dir,
+                           write_cache)
+
+# pytest progress characters: . pass, F fail, s skip, E error, x xfail,
+# X xpass. Kept as bytes so output can be checked without decoding it
+RESULT_CHARS = b'.FsExX'
+
+# Table for bytes.translate() which drops everything but RESULT_CHARS
+RESULT_DELETE = bytes(sorted(set(range(256)) - set(RESULT_CHARS)))
+
+# Result of a run which was stopped because it took too long
+TIMEOUT = 'timeout'
+
+
+def stop_proc(proc, grace=5):
+    """Stop a process and its children, e.g. after a timeout
+
+    Sends SIGINT to the process group so pytest can shut down U-Boot, then
+    SIGKILL if it has not exited after the grace period
+
+    Args:
+        proc (subprocess.Popen): Process, started with start_new_session=True
+        grace (float): Seconds to wait after SIGINT
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGINT)
+        proc.wait(grace)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def watch_proc(proc, timeout, cancel):
+    """Stop a process when it takes too long or is no longer needed
+
+    Args:
+        proc (subprocess.Popen): Process, started with start_new_session=True
+        timeout (float): Seconds to allow, or None for no limit
+        cancel (threading.Event): Event which is set when the result is no
+            longer needed, or None
+
+    Returns:
+        tuple:
+            threading.Event: Set if the process was cancelled
+            threading.Event: Set if the process timed out
+            threading.Timer: Timer to cancel once the process exits, or None
+    """
+    cancelled = threading.Event()
+    if cancel:
+        def watch():
+            cancel.wait()
+            if proc.poll() is None:
+                cancelled.set()
+                stop_proc(proc)
+
+        threading.Thread(target=watch, daemon=True).start()
+    expired = threading.Event()
+    timer = None
+    if timeout:
+        def expire():
+            expired.set()
+            stop_proc(proc)
+
+        timer = threading.Timer(timeout, expire)
+        timer.start()
+    return cancelled, expired, timer
+
+
+class PolluteCache:
+    """Cache of pollution-run verdicts
+
+    Verdicts are keyed by the target and the tests run before it. They are
+    remembered for the rest of the search, so the same run is never
+    repeated. Once a search has confirmed its polluter, save() writes them
+    to a file, so a later search can reuse them. The file is only read back
+    if the board, its options, the U-Boot tree and the build all match.
+
+    Properties:
+        name (str): Name of the cache file in ~/.cache/uman, or None to keep
+            verdicts in memory only
+        key (str): Key identifying the board, options, tree and build
+        verdicts (dict): Maps a hash of the tests to True if the target
+            failed, False if it passed
+    """
+    def __init__(self, name, key=None):
+        self.name = name
+        self.key = key
+        self.verdicts = {}
+        if name:
+            cached = read_cache(name, key)
+            if isinstance(cached, dict):
+                self.verdicts = cached
+
+    @staticmethod
+    def _key(tests, target):
+        """Get the cache key for a run"""
+        ids = '|'.join(tests + [target])
+        return hashlib.blake2b(ids.encode(), digest_size=16).hexdigest()
+
+    def get(self, tests, target):
+        """Look up the verdict for a run
+
+        Args:
+            tests (list): Tests run before the target (full node IDs)
+            target (str): Target test (full node ID)
+
+        Returns:
+            bool or None: True if the target failed, False if it passed,
+                None if the run is not in the cache
+        """
+        return self.verdicts.get(self._key(tests, target))
+
+    def put(self, tests, target, failed):
+        """Record the verdict for a run
+
+        Args:
+            tests (list): Tests run before the target (full node IDs)
+            target (str): Target test (full node ID)
+            failed (bool): True if the target failed
+        """
+        self.verdicts[self._key(tests, target)] = failed
+
+    def save(self):
+        """Write the verdicts to the cache file, if any"""
+        if self.name:
+            write_cache(self.name, self.key, self.verdicts)
+
+
+def get_tree_state():
+    """Get a hash of the uncommitted changes in the U-Boot tree
+
+    This covers changes to tracked files and any untracked files under
+    test/py, e.g. a test being edited to fix a polluter.
+
+    Returns:
+        str: Hash of the changes
+
+    Raises:
+        command.CommandExc: If git fails
+    """
+    # The diff may include text files which are not UTF-8
+    state = hashlib.sha1(git_output('diff', '--binary', 'HEAD', binary=True))
+    others = git_output('ls-files', '--others', '--exclude-standard', '--',
+                        TEST_PY_DIR)
+    for fname in others.splitlines():
+        state.update(fname.encode())
+        try:
+            state.update(tools.read_file(fname))
+        except OSError:
+            pass
+    return state.hexdigest()
+
+
+def get_pollute_cache(args, build_dir):
+    """Get the verdict cache for a pollution search
+
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
+        build_dir (str): Build directory used for the search
+
+    Returns:
+        PolluteCache: Cache, held in memory only if disabled or the state of
+            the U-Boot tree cannot be determined
+    """
+    if args.no_cache:
+        return PolluteCache(None)
+    try:
+        sha = git_output('rev-parse', 'HEAD')
+        state = get_tree_state()
+    except command.CommandExc:
+        return PolluteCache(None)
+    exe = os.path.join(build_dir, 'u-boot')
+    mtime = os.path.getmtime(exe) if os.path.exists(exe) else 0
+    key = f'{args.full}|{args.lto}|{sha}|{state}|{mtime}'
+    return PolluteCache(f'pollute-{args.board}.json', key)
+
+
+def count_steps(count, ways):
+    """Work out how many steps a search needs to narrow down the candidates
+
+    Args:
+        count (int): Number of candidates
+        ways (int): Number of parts the candidates are split into each step
+
+    Returns:
+        int: Number of steps
+    """
+    if ways == 2:
+        # ceil(log2(n)) without floating point; 0 for zero or one candidate
+        return max(count - 1, 0).bit_length()
+    steps = 0
+    while count > 1:
+        count = -(-count // ways)
+        steps += 1
+    return steps
+
+
+class Search:
+    """A search for the test which pollutes a target test
+
+    Properties:
+        target (str): Target test (full node ID)
+        args (argparse.Namespace): Arguments from cmdline
+        env (dict): Full environment for pytest, built once by the caller;
+            this is passed straight to each subprocess and not modified
+        cache (PolluteCache): Verdicts of the runs so far
+    """
+    def __init__(self, target, args, env, cache):
+        self.target = target
+        self.args = args
+        self.env = env
+        self.cache = cache
+
+    def pytest_cmd(self, tests, slot=None):
+        """Get the pytest command to run a subset of tests and the target
+
+        Args:
+            tests (list): Tests to run before target (full node IDs)
+            slot (int): Slot number when running alongside other runs, or
+                None. Each slot uses its own result and persistent-data
+                directories
+
+        Returns:
+            list of str: Command to run
+        """
+        args = self.args
+        build_dir = get_build_dir(args, suffix='-pollute')
+
+        # Convert node IDs to test names and join with "or" for -k
+        spec = ' or '.join(node_to_name(t) for t in tests + [self.target])
+
+        cmd = ['./test/py/test.py', '-B', args.board, '--build-dir',
+               build_dir, '--buildman', '--id', 'na', '-q', '-k', spec]
+
+        # Pollution only shows up when the polluter runs in the same process
+        # before the target, so make sure xdist cannot spread the tests
+        # across workers, e.g. via PYTEST_ADDOPTS
+        cmd.extend(['-p', 'no:xdist'] + plugin_args([]))
+
+        # Any failure counts as a failing run, so there is no point in
+        # running the rest once one test has failed. Do not use --ff, since
+        # reordering the tests would hide the pollution
+        cmd.append('-x')
+        if args.lto:
+            cmd.append('--lto')
+        if not args.full:
+            cmd.append('--no-full')
+        if slot is not None:
+            slot_dir = f'{build_dir}/slot{slot}'
+            cmd.extend(['--result-dir', slot_dir, '--persistent-data-dir',
+                        f'{slot_dir}/persistent-data'])
+        return cmd
+
+    def run_pytest(self, tests, slot=None, cancel=None):
+        """Run a subset of tests followed by the target test
+
+        A run is stopped after args.pollute_timeout seconds, if set.
+
+        Args:
+            tests (list): Tests to run before target (full node IDs)
+            slot (int): Slot number when running alongside other runs, or
+                None. No progress is shown for a slot
+            cancel (threading.Event): Event which is set when the result is
+                no longer needed, or None. The run is stopped if still going
+
+        Returns:
+            bool or None or str: True if target test failed, False if it
+                passed, None if the run was cancelled, TIMEOUT if it timed
+                out
+        """
+        # Each run must be a fresh pytest process: a long-lived pytest
+        # serving several runs would keep the U-Boot (e.g. sandbox) state
+        # left by one run into the next, which is exactly the pollution being
+        # searched for
+        #
+        # Run with Popen to show progress as tests complete
+        timeout = self.args.pollute_timeout
+        own_session = bool(timeout or cancel)
+        # pylint: disable=consider-using-with
+        proc = subprocess.Popen(self.pytest_cmd(tests, slot), env=self.env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                start_new_session=own_session)
+        cancelled, expired, timer = watch_proc(proc, timeout, cancel)
+        done = 0
+        try:
+            while True:
+                buf = proc.stdout.read1(4096)
+                if not buf:
+                    break
+                if slot is None:
+                    count = len(buf.translate(None, RESULT_DELETE))
+                    if count:
+                        done += count
+                        tout.progress(f'    {done}/{len(tests) + 1}',
+                                      trailer='')
+        except BaseException:
+            # Ctrl+C does not reach a run in its own session, so stop it
+            # here rather than leaving it running
+            if own_session:
+                stop_proc(proc)
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+        tout.clear_progress()
+        proc.wait()
+        if cancelled.is_set():
+            return None
+        if expired.is_set():
+            return TIMEOUT
+        return proc.returncode != 0
+
+    def run(self, tests, slot=None, cancel=None):
+        """Run a subset of tests and the target, unless the verdict is cached
+
+        A run which times out counts as a failure, since a hang may be what
+        the polluter does to the target. The user is told which run it was,
+        and it is not cached, since it may just be down to a slow machine.
+
+        Args:
+            tests (list): Tests to run before target (full node IDs)
+            slot (int): Slot number for concurrent runs, or None
+            cancel (threading.Event): Event set when the result is no longer
+                needed, or None
+
+        Returns:
+            bool or None: True if target test failed, False if it passed,
+                None if the run was cancelled
+        """
+        failed = self.cache.get(tests, self.target)
+        if failed is not None:
+            tout.info('  (cached)')
+            return failed
+        failed = self.run_pytest(tests, slot, cancel)
+        if failed == TIMEOUT:
+            what = 'target alone'
+            if tests:
+                what = (f'{len(tests)} tests ({node_to_name(tests[0])} .. '
+                        f'{node_to_name(tests[-1])})')
+            tout.warning(f'Run of {what} timed out after '
+                         f'{self.args.pollute_timeout}s, counting it as a '
+                         'failure')
+            return True
+        if failed is not None:
+            self.cache.put(tests, self.target, failed)
+        return failed
+
+    def run_parts(self, parts):
+        """Run several subsets of the candidates at once, each in its own slot
+
+        Each part is followed by the target. As soon as the part holding the
+        polluter is known, any runs still going are stopped.
+
+        Args:
+            parts (list of list): Subsets to run (node IDs)
+
+        Returns:
+            int: Index of the first part whose run failed, or len(parts) if
+                none did
+        """
+        # Only needed for --pollute-jobs, so keep it off the normal import
+        # path
+        # pylint: disable=import-outside-toplevel
+        import concurrent.futures
+
+        def decide(fails):
+            """Get the part holding the polluter, or None if not known yet"""
+            for idx, failed in enumerate(fails):
+                if failed is None:
+                    return None
+                if failed:
+                    return idx
+            return len(fails)
+
+        cancel = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(len(parts)) as pool:
+            try:
+                futures = [pool.submit(self.run, part, slot, cancel)
+                           for slot, part in enumerate(parts)]
+                fails = [None] * len(futures)
+                for fut in concurrent.futures.as_completed(futures):
+                    fails[futures.index(fut)] = fut.result()
+                    idx = decide(fails)
+                    if idx is not None:
+                        break
+            finally:
+                # Stop any runs whose result is no longer needed. This also
+                # happens on Ctrl+C, since leaving the pool waits for every
+                # run to finish
+                cancel.set()
+        return idx
+
+    def bisect(self, candidates):
+        """Search for the polluter by splitting the candidates into parts
+
+        Each step splits the candidates into args.pollute_jobs + 1 disjoint
+        parts and runs all but the last part, each followed by the target.
+        The first part whose run fails holds the polluter. If none fail, it
+        is in the last part. With a single job this is a plain binary search
+        over halves, so each step runs about half as many tests as the one
+        before.
+
+        Args:
+            candidates (list): Tests which may pollute the target (node IDs)
+
+        Returns:
+            list: Remaining candidates, normally a single test
+        """
+        ways = self.args.pollute_jobs + 1
+        steps = count_steps(len(candidates), ways)
+        step = 0
+        while len(candidates) > 1:
+            step += 1
+            size = -(-len(candidates) // ways)
+            parts = [candidates[i:i + size]
+                     for i in range(0, len(candidates), size)]
+            if ways == 2:
+                print(f'  Step {step}/{steps}: {size} tests...')
+                failed = self.run(parts[0])
+                tout.notice('  -> FAIL (polluter in first half)' if failed
+                            else '  -> PASS (polluter in second half)')
+                idx = 0 if failed else 1
+            else:
+                print(f'  Step {step}/{steps}: {len(parts) - 1} runs of up '
+                      f'to {size} tests...')
+                idx = self.run_parts(parts[:-1])
+                tout.notice(f'  -> polluter in part {idx + 1}/{len(parts)}')
+            candidates = parts[idx]
+        return candidates
+
+    def find(self, candidates):
+        """Check the target is polluted, then search for the polluter
+
+        Args:
+            candidates (list): Tests which may pollute the target (node IDs)
+
+        Returns:
+            str: Polluter (full node ID), or None if not found
+        """
+        # Verify target passes alone, unless the user vouches for it
+        if self.args.trust_target:
+            tout.info('Skipping check that target passes alone')
+        else:
+            tout.notice('Verifying target passes alone...')
+            if self.run([]):
+                tout.error(
+                    'Target test fails when run alone - not a pollution issue')
+                return None
+            tout.notice('  OK')
+
+        # Verify target fails with all candidates
+        tout.notice('Verifying target fails with all prior tests...')
+        if not self.run(candidates):
+            tout.error(
+                'Target test passes with all prior tests - cannot reproduce')
+            return None
+        tout.notice('  FAIL (confirmed)')
+
+        tout.notice(
+            f'Searching for polluter in {len(candidates)} candidates...')
+        candidates = self.bisect(candidates)
+        if not candidates:
+            tout.error('No polluter found - may need multiple tests to trigger')
+            return None
+        polluter = candidates[0]
+
+        # Final verification; this comes from the cache if the search already
+        # ran the polluter on its own, e.g. when it is the first candidate
+        print(f'  Verifying {node_to_name(polluter)}...')
+        if not self.run([polluter]):
+            tout.notice('  -> PASS (inconclusive - may need multiple tests)')
+            return None
+        tout.notice('  -> FAIL (confirmed)')
+        self.cache.save()
+        return polluter
+
+
+def find_target(tests, name):
+    """Find the target test in the collected tests
+
+    Args:
+        tests (list): Collected tests (full node IDs)
+        name (str): Target test, or part of its node ID
+
+    Returns:
+        int: Position of the first test containing name, or None if there is
+            none or it is the first test, so nothing can pollute it
+    """
+    for i, test in enumerate(tests):
+        if name in test:
+            tout.notice(f"Found {len(tests)} tests, target '{test}' at "
+                        f'position {i + 1}')
+            if not i:
+                tout.error('Target is the first test - nothing can pollute it')
+                return None
+            return i
+
+    tout.error(f"Target test '{name}' not found in collection")
+    tout.info('Available tests containing that string:')
+    for test in tests:
+        if name.lower() in test.lower():
+            print(f'  {test}')
+    return None
+
+
+def do_pollute(args):
+    """Find which test pollutes the target test
+
+    Args:
+        args (argparse.Namespace): Arguments from cmdline
+
+    Returns:
+        int: Exit code
+    """
+    path_exists.cache_clear()
+    uboot_dir = setup_board(args) and setup_uboot_dir()
+    if not uboot_dir:
+        return 1
+
+    # Build to the pollute directory if requested
+    build_dir = get_build_dir(args, suffix='-pollute')
+    if args.build:
+        tout.notice(f'Building to {build_dir}...')
+        cmd = ['buildman', '-I', '-w', '--boards', args.board, '-o', build_dir]
+        if not args.lto:
+            cmd.insert(1, '-L')
+        result = exec_cmd(cmd, args.dry_run, capture=False)
+        if result and result.return_code != 0:
+            tout.error('Build failed')
+            return 1
+        path_exists.cache_clear()
+
+    tout.notice('Collecting tests...')
+    tests = collect_tests(args, build_dir)
+    if tests is None:
+        return 1
+
+    idx = find_target(tests, args.pollute)
+    if idx is None:
+        return 1
+    target = tests[idx]
+
+    # Build the environment once; every run below shares it
+    env = os.environ.copy()
+    env.update(pytest_env(args.board, uboot_dir))
+    search = Search(target, args, env, get_pollute_cache(args, build_dir))
+    polluter = search.find(tests[:idx])
+    if not polluter:
+        return 1
+
+    col = terminal.Color()
+    red = col.start(terminal.Color.RED)
+    reset = col.stop()
+    tout.notice(f'\nFound: {node_to_name(target)} polluted by '
+                f'{red}{node_to_name(polluter)}{reset}')
+    tout.notice(f'  Run: uman py -B {args.board} "{polluter} or {target}"')
+    return 0
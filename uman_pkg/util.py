@@ -7,6 +7,8 @@
 This module provides common utility functions used across uman modules.
 """
 
+import functools
+import json
 import os
 import shlex
 import subprocess
@@ -20,26 +22,41 @@ from u_boot_pylib import tout
 from uman_pkg import settings
 
 
-def get_uboot_dir():
-    """Get the U-Boot source directory
+@functools.lru_cache(maxsize=None)
+def find_uboot_dir(cwd, usrc):
+    """Find the U-Boot source directory for a given cwd and $USRC
 
-    Checks if current directory is a U-Boot tree, otherwise uses $USRC.
+    The result is cached since this is called many times per command.
+
+    Args:
+        cwd (str): Current directory
+        usrc (str or None): Value of $USRC
 
     Returns:
         str: Path to U-Boot source directory, or None if not found
     """
     # Check if current directory is a U-Boot tree
-    if os.path.exists('./test/py/test.py'):
-        return os.getcwd()
+    if os.path.exists(os.path.join(cwd, 'test/py/test.py')):
+        return cwd
 
     # Try USRC environment variable
-    usrc = os.environ.get('USRC')
     if usrc and os.path.exists(os.path.join(usrc, 'test/py/test.py')):
         return usrc
 
     return None
 
 
+def get_uboot_dir():
+    """Get the U-Boot source directory
+
+    Checks if current directory is a U-Boot tree, otherwise uses $USRC.
+
+    Returns:
+        str: Path to U-Boot source directory, or None if not found
+    """
+    return find_uboot_dir(os.getcwd(), os.environ.get('USRC'))
+
+
 def setup_uboot_dir():
     """Find and change to the U-Boot source directory
 
@@ -58,7 +75,7 @@ def setup_uboot_dir():
     return uboot_dir
 
 
-def exec_cmd(cmd, dry_run=False, env=None, capture=True):
+def exec_cmd(cmd, dry_run=False, env=None, capture=True, binary=False):
     """Run a command or show what would be run in dry-run mode
 
     Args:
@@ -67,6 +84,8 @@ def exec_cmd(cmd, dry_run=False, env=None, capture=True):
         env (dict): Optional environment variables to set
         capture (bool): Whether to capture output (default True). When False,
             runs interactively with proper Ctrl+C handling.
+        binary (bool): Return captured output as bytes rather than decoding
+            it, e.g. when it may not be valid UTF-8
 
     Returns:
         CommandResult or None: Result if run, None if dry-run
@@ -98,7 +117,7 @@ def exec_cmd(cmd, dry_run=False, env=None, capture=True):
                                      stdout='', stderr=stderr)
 
     return command.run_pipe([cmd], env=env, capture=capture,
-                            raise_on_error=False)
+                            raise_on_error=False, binary=binary)
 
 
 def run_pytest(test_name, board='sandbox', build_dir=None, quiet=True,
@@ -146,19 +165,22 @@ def run_pytest(test_name, board='sandbox', build_dir=None, quiet=True,
     return True
 
 
-def git_output(*args):
+def git_output(*args, binary=False):
     """Run a git command and return its output
 
     Args:
         *args: Arguments to pass to git (e.g., 'status', '-sb')
+        binary (bool): True to return the output as bytes, e.g. when it
+            may not be valid UTF-8
 
     Returns:
-        str: Command output (stdout), stripped of trailing whitespace
+        str or bytes: Command output (stdout), stripped of trailing
+            whitespace
 
     Raises:
         command.CommandExc: If the command fails
     """
-    return command.output('git', *args).strip()
+    return command.output('git', *args, binary=binary).strip()
 
 
 def git(*args, env=None, dry_run=False):
@@ -177,6 +199,50 @@ def git(*args, env=None, dry_run=False):
     return exec_cmd(cmd, dry_run=dry_run, env=env, capture=True)
 
 
+def read_cache(name, key):
+    """Read data from a JSON file in the uman cache directory
+
+    Args:
+        name (str): Filename within ~/.cache/uman
+        key (str): Key which the data must have been written with
+
+    Returns:
+        object: Data from the file, or None if the file is missing or
+            unreadable, or was written with a different key
+    """
+    fname = os.path.expanduser(f'~/.cache/uman/{name}')
+    try:
+        with open(fname, 'r', encoding='utf-8') as inf:
+            cached = json.load(inf)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    return cached.get('data')
+
+
+def write_cache(name, key, data):
+    """Write data to a JSON file in the uman cache directory
+
+    The file is replaced in one step, so a reader never sees part of it.
+    Errors are ignored since the cache is only there to save time.
+
+    Args:
+        name (str): Filename within ~/.cache/uman
+        key (str): Key to check when reading the data back
+        data (object): Data to write, which must be JSON-serialisable
+    """
+    fname = os.path.expanduser(f'~/.cache/uman/{name}')
+    tmp = f'{fname}.tmp'
+    try:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as outf:
+            json.dump({'key': key, 'data': data}, outf)
+        os.replace(tmp, fname)
+    except OSError:
+        pass
+
+
 def format_duration(seconds):
     """Format a duration in seconds as a human-readable string
 